@@ -0,0 +1,415 @@
+"""
+Weighted quantile kernels, re-exported by `data_science_tools.weighted`.
+"""
+import numpy as np
+
+
+def quantile_1d(data, weights, quantile_limit):
+    """Compute the weighted quantile of a 1D numpy array.
+
+    Parameters:
+        data : ndarray
+            Input array (one dimension).
+        weights : ndarray
+            Array with the weights of the same size of `data`.
+        quantile_limit : float or array_like of floats
+            Quantile(s) to compute. They must have values between 0 and 1.
+            All quantiles are computed from the same sort of `data`.
+
+    Returns:
+        quantile_1d : float or ndarray
+            The output value. If `quantile_limit` is an array then the result
+            has the same shape as `quantile_limit`.
+    """
+    data, weights = _check_1d(data, weights)
+
+    _check_quantile_limit(quantile_limit)
+
+    # Sort the data
+    ind_sorted = np.argsort(data)
+    sorted_data = data[ind_sorted]
+    notnan = ~np.isnan(sorted_data)
+    if np.count_nonzero(notnan) == 0:
+        if np.ndim(quantile_limit):
+            return np.full(np.shape(quantile_limit), np.nan)
+        return np.nan
+
+    sorted_weights = np.nan_to_num(weights[ind_sorted][notnan])
+
+    # Compute the auxiliary arrays
+    cuml_weights = np.cumsum(sorted_weights)
+
+    # TO DO: Check that the weights do not sum zero
+    prob_normalized = (cuml_weights - 0.5 * sorted_weights) / np.sum(sorted_weights)
+
+    # Get the value of the weighted median
+    return np.interp(quantile_limit, prob_normalized, sorted_data[notnan])
+
+
+def quantile_select_1d(data, weights, quantile_limit):
+    """Compute the weighted quantile of a 1D array by selection.
+
+    Same result as `quantile_1d` but instead of a full sort it narrows in on
+    the element where the cumulative weight crosses the quantile with
+    `np.partition` pivots and partial weight sums (weighted quickselect).
+    Expected O(n) per quantile instead of O(n log n), which wins for large
+    arrays and a few quantiles such as the median. Where tied values or zero
+    weights make the crossing ambiguous it may settle on a different one of
+    the tied candidates than the sort would.
+
+    Parameters:
+        data : ndarray
+            Input array (one dimension).
+        weights : ndarray
+            Array with the weights of the same size of `data`.
+        quantile_limit : float or array_like of floats
+            Quantile(s) to compute. They must have values between 0 and 1.
+
+    Returns:
+        quantile_select_1d : float or ndarray
+            The output value. If `quantile_limit` is an array then the result
+            has the same shape as `quantile_limit`.
+    """
+    data, weights = _check_1d(data, weights)
+
+    _check_quantile_limit(quantile_limit)
+
+    notnan = ~np.isnan(data)
+    if np.count_nonzero(notnan) == 0:
+        if np.ndim(quantile_limit):
+            return np.full(np.shape(quantile_limit), np.nan)
+        return np.nan
+    data = data[notnan]
+    weights = np.nan_to_num(weights[notnan])
+    total_weights = np.sum(weights)
+
+    if np.ndim(quantile_limit) == 0:
+        return _select_1d(data, weights, total_weights, quantile_limit)
+    results = [
+        _select_1d(data, weights, total_weights, q) for q in np.ravel(quantile_limit)
+    ]
+    return np.reshape(results, np.shape(quantile_limit))
+
+
+def _select_1d(data, weights, total_weights, quantile_limit, cutoff=256):
+    """Weighted quickselect for `quantile_select_1d`.
+
+    Keeps only the segment which contains the first element whose normalized
+    probability (as in `quantile_1d`) exceeds the quantile, plus the element
+    just before it. Small segments are finished with a sort.
+    """
+    weight_below = 0.0
+    previous = None
+    while len(data) > cutoff:
+        kth = len(data) // 2
+        ind_partition = np.argpartition(data, kth)
+        data = data[ind_partition]
+        weights = weights[ind_partition]
+        weight_left = weight_below + np.sum(weights[:kth])
+        pivot_prob = (weight_left + 0.5 * weights[kth]) / total_weights
+        split = kth + 1
+        if pivot_prob > quantile_limit:
+            data = data[:split]
+            weights = weights[:split]
+        else:
+            previous = (pivot_prob, data[kth])
+            weight_below = weight_left + weights[kth]
+            data = data[split:]
+            weights = weights[split:]
+
+    return _sort_segment(
+        data, weights, weight_below, total_weights, quantile_limit, previous
+    )
+
+
+def _sort_segment(data, weights, weight_below, total_weights, quantile_limit, previous):
+    """Finish `_select_1d` on the remaining segment with a sort"""
+    ind_sorted = np.argsort(data)
+    sorted_data = data[ind_sorted]
+    sorted_weights = weights[ind_sorted]
+    cuml_weights = weight_below + np.cumsum(sorted_weights)
+    prob_normalized = (cuml_weights - 0.5 * sorted_weights) / total_weights
+    if previous is not None:
+        prob_normalized = np.r_[previous[0], prob_normalized]
+        sorted_data = np.r_[previous[1], sorted_data]
+    return np.interp(quantile_limit, prob_normalized, sorted_data)
+
+
+def quantile(data, weights, quantile_limit, axis=-1, out=None, work=None):
+    """Weighted quantile of an array with respect to the given axis.
+
+    All the rows are computed together from a single argsort along the axis
+    rather than calling `quantile_1d` row by row. The NaN semantics are the
+    same as `quantile_1d`.
+
+    Parameters:
+        data : ndarray
+            Input array.
+        weights : ndarray
+            Array with the weights. It must either have the shape of the
+            reduced axes of `data` (e.g. the size of the axis) or be
+            broadcastable to the shape of `data`.
+        quantile_limit : float or array_like of floats
+            Quantile(s) to compute. They must have values between 0 and 1.
+        axis : int, tuple of ints or None
+            Axis or axes along which to compute the quantile. The default is
+            the last axis and None is all the axes. The axes are moved to the
+            end as a view, data is only copied if they can't be merged
+            without one.
+        out : ndarray, optional
+            Array to copy the result into, of the shape and dtype of the
+            result.
+        work : ndarray, optional
+            Scratch buffer for the sorted data, weights and cumulative
+            weights. A 1D float64 array of at least `3 * data.size` elements
+            (`4 * data.size` for data wider than float64). Reuse it between
+            calls in a loop to avoid allocating the sorted arrays. The
+            argsort indices, the NaN mask and the interpolation are still
+            allocated.
+
+    Returns:
+        quantile : float or ndarray
+            The output value. The shape is `quantile_limit.shape` followed
+            by the shape of `data` without the reduced axes. In the dtype of
+            `data` if it is floating point (e.g. float32 stays float32) and
+            float64 otherwise. The weights are always summed in float64.
+
+    """
+    data = np.asarray(data)
+    if data.ndim == 0:
+        raise TypeError("data must have at least one dimension")
+
+    axes = _normalize_axes(axis, data.ndim)
+    weights = _broadcast_weights(data, weights, axes)
+    dtype = _float_dtype(data)
+    if data.ndim == 1 and out is None and work is None and dtype == np.float64:
+        return quantile_1d(data, np.broadcast_to(weights, data.shape), quantile_limit)
+
+    _check_quantile_limit(quantile_limit)
+
+    data, weights, shape = _as_rows(data, weights, axes)
+    shape = np.shape(quantile_limit) + shape
+    if out is not None and (out.shape != shape or out.dtype != dtype):
+        raise ValueError(f"out must be a {dtype} array of shape {shape}")
+    result = _quantile_rows(data, weights, quantile_limit, dtype, work)
+    result = result.reshape(shape)
+    if out is not None:
+        out[...] = result
+        return out
+    return result[()]
+
+
+def _float_dtype(data):
+    """Floating point dtype to compute in, float64 unless data is floating"""
+    if np.issubdtype(data.dtype, np.floating):
+        return data.dtype
+    return np.dtype(np.float64)
+
+
+def _as_rows(data, weights, axes):
+    """Reshape data and weights to 2D with the reduced axes last.
+
+    The axes are moved as views, the reshape only copies when the strides
+    can't be merged. Weights shared along the batch are kept as one row.
+
+    Returns:
+        (data, weights, shape): 2D data of (rows, length), weights of
+            (rows or 1, length) and the batch shape of the rows.
+    """
+    batch_ndim = data.ndim - len(axes)
+    destination = tuple(range(batch_ndim, data.ndim))
+    data = np.moveaxis(data, axes, destination)
+    weights = np.moveaxis(weights, axes, destination)
+    shape = data.shape[:batch_ndim]
+    reduced_shape = data.shape[batch_ndim:]
+    rows = int(np.prod(shape))
+    length = int(np.prod(reduced_shape))
+
+    data = data.reshape((rows, length))
+    if np.prod(weights.shape[:batch_ndim]) == 1:
+        # shared along the batch, only the reduced axes are materialized
+        weights = np.broadcast_to(weights, (1,) * batch_ndim + reduced_shape)
+        weights = weights.reshape((1, length))
+    else:
+        weights = np.broadcast_to(weights, shape + reduced_shape)
+        weights = weights.reshape((rows, length))
+    return data, weights, shape
+
+
+def _normalize_axes(axis, ndim):
+    """Return axis as a tuple of unique non-negative ints"""
+    if axis is None:
+        return tuple(range(ndim))
+    axes = tuple(np.atleast_1d(axis).tolist())
+    normalized = []
+    for ax in axes:
+        if not -ndim <= ax < ndim:
+            raise ValueError(
+                f"axis {ax} is out of bounds for array of dimension {ndim}"
+            )
+        normalized.append(ax % ndim)
+    if len(set(normalized)) != len(normalized):
+        raise ValueError("repeated axis")
+    return tuple(normalized)
+
+
+def _broadcast_weights(data, weights, axes):
+    """Align weights with data without copying.
+
+    Weights shaped like the reduced axes (in the order of `axes`) are
+    aligned along those axes, anything else must broadcast to `data`. The
+    result has `data.ndim` dimensions, possibly of length one.
+    """
+    weights = np.asarray(weights)
+    if weights.shape != data.shape and weights.shape == tuple(
+        data.shape[ax] for ax in axes
+    ):
+        weights = weights.transpose(np.argsort(axes))
+        shape = [data.shape[ax] if ax in axes else 1 for ax in range(data.ndim)]
+        weights = weights.reshape(shape)
+    try:
+        if np.broadcast_shapes(weights.shape, data.shape) != data.shape:
+            raise ValueError
+    except ValueError as error:
+        raise TypeError(
+            "weights must match the reduced axes or broadcast to data"
+        ) from error
+    return weights.reshape((1,) * (data.ndim - weights.ndim) + weights.shape)
+
+
+def _check_1d(data, weights, dtype=None):
+    """Raise TypeError unless data and weights are 1D of the same shape"""
+    data = np.asarray(data, dtype=dtype)
+    weights = np.asarray(weights, dtype=dtype)
+    if data.ndim != 1:
+        raise TypeError("data must be a one dimensional array")
+
+    if data.shape != weights.shape:
+        raise TypeError("the length of data and weights must be the same")
+    return data, weights
+
+
+def _check_quantile_limit(quantile_limit):
+    """Raise ValueError unless all quantile limits are in [0, 1]"""
+    quantile_limit = np.asarray(quantile_limit)
+    if not np.all((quantile_limit >= 0.0) & (quantile_limit <= 1.0)):
+        raise ValueError("quantile must have a value between 0.0 and 1.0")
+
+
+def _quantile_rows(data, weights, quantile_limit, dtype=np.float64, work=None):
+    """Weighted quantile of every row of a 2D array.
+
+    Same computation as `quantile_1d` but vectorized over the rows and the
+    quantile limits, result shape is `quantile_limit.shape + (rows,)`. NaN
+    values sort to the end of each row so the valid values of a row are
+    always the leading segment. The sorted arrays live in `work` (see
+    `quantile`) and are updated in place. The data is sorted in `dtype` but
+    the weights are summed in float64, a float32 sum stops growing at 2**24.
+    """
+    size = data.size
+    # float64 elements taken by the sorted data, then the weights and the
+    # cumulative weights
+    data_slot = -(-np.dtype(dtype).itemsize // 8) * size
+    if work is None:
+        work = np.empty(data_slot + 2 * size)
+    elif work.dtype != np.float64 or work.ndim != 1 or work.size < data_slot + 2 * size:
+        raise ValueError(
+            f"work must be a 1D float64 array of at least {data_slot + 2 * size}"
+        )
+    sorted_data = work[:data_slot].view(dtype)[:size].reshape(data.shape)
+    sorted_weights, prob_normalized = work[data_slot:][: 2 * size].reshape(
+        (2,) + data.shape
+    )
+
+    starts, stops = _sort_rows(data, weights, sorted_data, sorted_weights)
+    total_weights = np.sum(sorted_weights, axis=-1, keepdims=True)
+    np.cumsum(sorted_weights, axis=-1, out=prob_normalized)
+    sorted_weights *= 0.5
+    prob_normalized -= sorted_weights
+    # rows of all NaN have no weight, they are set to NaN by _interp_segments
+    with np.errstate(invalid="ignore", divide="ignore"):
+        prob_normalized /= total_weights
+
+    return _interp_segments(
+        np.expand_dims(quantile_limit, -1),
+        prob_normalized.ravel(),
+        sorted_data.ravel(),
+        starts,
+        stops,
+    ).astype(dtype, copy=False)
+
+
+def _sort_rows(data, weights, sorted_data, sorted_weights):
+    """Sort every row of data with its weights into the given arrays.
+
+    NaN values get zero weight. Returns the flat start and stop of the
+    valid values of every row.
+    """
+    rows, length = data.shape
+    ind_sorted = np.argsort(data, axis=-1)
+    if len(weights) == 1:
+        np.take(weights[0].astype(float), ind_sorted, out=sorted_weights, mode="clip")
+    # flat indices into the rows, in place
+    starts = np.arange(rows) * length
+    ind_sorted += starts[:, np.newaxis]
+    _take_flat(data, ind_sorted, sorted_data)
+    if len(weights) != 1:
+        _take_flat(weights, ind_sorted, sorted_weights)
+    del ind_sorted
+
+    nanmask = np.isnan(sorted_data)
+    np.nan_to_num(sorted_weights, copy=False)
+    np.copyto(sorted_weights, 0, where=nanmask)
+    stops = starts + length - np.count_nonzero(nanmask, axis=-1)
+    return starts, stops
+
+
+def _take_flat(values, flat_indices, out):
+    """out = values.ravel()[flat_indices], directly into out when possible"""
+    if values.flags.c_contiguous and values.dtype == out.dtype:
+        np.take(values.reshape(-1), flat_indices, out=out, mode="clip")
+    else:
+        out[...] = values.reshape(-1)[flat_indices]
+
+
+def _searchsorted_segments(sorted_values, starts, stops, keys):
+    """Vectorized `np.searchsorted(side="right")` within many segments.
+
+    Each `sorted_values[starts[i]:stops[i]]` must be sorted. Runs a binary
+    search for every key at once and returns the absolute insertion index.
+    """
+    lower, keys = np.broadcast_arrays(starts, keys)
+    lower = lower.copy()
+    upper = np.broadcast_to(stops, lower.shape).copy()
+    active = lower < upper
+    while np.any(active):
+        middle = (lower + upper) // 2
+        go_right = sorted_values.take(middle, mode="clip") <= keys
+        lower = np.where(active & go_right, middle + 1, lower)
+        upper = np.where(active & ~go_right, middle, upper)
+        active = lower < upper
+    return lower
+
+
+def _interp_segments(x, xp, fp, starts, stops):
+    """Vectorized `np.interp(x, xp[start:stop], fp[start:stop])` per segment.
+
+    Follows the same rules as `np.interp`, including clamping to the end
+    values outside of the range. Empty segments return NaN.
+    """
+    j = _searchsorted_segments(xp, starts, stops, x) - 1
+    x = np.broadcast_to(x, j.shape)
+    j_clip = np.maximum(j, starts)
+    xp_j = xp.take(j_clip, mode="clip")
+    fp_j = fp.take(j_clip, mode="clip")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = (fp.take(j_clip + 1, mode="clip") - fp_j) / (
+            xp.take(j_clip + 1, mode="clip") - xp_j
+        )
+        result = slope * (x - xp_j) + fp_j
+
+    last = stops - 1
+    result = np.where(xp_j == x, fp_j, result)
+    result = np.where(j >= last, fp.take(last, mode="clip"), result)
+    result = np.where(j < starts, fp.take(starts, mode="clip"), result)
+    return np.where(starts < stops, result, np.nan)
@@ -0,0 +1,588 @@
+"""
+Resampling machinery of the bootstrap, used by `data_science_tools.statistics`.
+"""
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+import hashlib
+import json
+from multiprocessing import shared_memory
+import os
+import time
+
+import pandas as pd
+import numpy as np
+
+
+_WEIGHT_METHODS = ("multinomial", "poisson", "bayesian")
+_BLOCK_METHODS = ("moving_block", "stationary")
+_SAMPLE_METHODS = ("choice", "integer") + _WEIGHT_METHODS + _BLOCK_METHODS
+
+
+def _seeded_chunks(seed_sequence, iterations, chunk_size):
+    """(seed, iterations) of every chunk, seeded by children of seed_sequence"""
+    starts = range(0, iterations, chunk_size)
+    seeds = seed_sequence.spawn(len(starts))
+    return [
+        (child, min(chunk_size, iterations - start))
+        for child, start in zip(seeds, starts)
+    ]
+
+
+def _collect(data, chunks, options, n_jobs, convergence):
+    """Results of all chunks as one list, stops early once converged"""
+    bootstrap_results = []
+    with closing(_map_chunks(data, chunks, options, n_jobs)) as chunk_results:
+        for results in chunk_results:
+            bootstrap_results.extend(results)
+            if convergence is not None and convergence.update(results):
+                break
+    return bootstrap_results
+
+
+def _block_length(length, block_length, sample_method):
+    """Validate the block length of the block methods, default length**(1/3)"""
+    if sample_method not in _BLOCK_METHODS:
+        return None
+    if block_length is None:
+        block_length = max(1, round(length ** (1 / 3)))
+    if not 1 <= block_length <= length:
+        raise ValueError("block_length should be between 1 and the length")
+    return int(block_length)
+
+
+def _sample_size(
+    length, bootstrap_sample_size, bootstrap_min_sample_size, sample_method
+):
+    """Validate the bootstrap sampling and return the sample size"""
+    if bootstrap_sample_size < 1.0:
+        number = int(length * bootstrap_sample_size)  # sample_size
+    else:
+        number = int(bootstrap_sample_size)
+
+    if not callable(sample_method) and sample_method not in _SAMPLE_METHODS:
+        raise ValueError(
+            "sample_method should be 'choice', 'integer', 'multinomial', "
+            "'poisson', 'bayesian', 'moving_block' or 'stationary'"
+        )
+    # if the number requested is larger than the length just return all the
+    # indicies, weights and blocks are drawn with replacement and may be more
+    if number >= length and sample_method not in _WEIGHT_METHODS + _BLOCK_METHODS:
+        raise ValueError("sample size is larger then length")
+    elif number < bootstrap_min_sample_size:
+        raise ValueError("sample size is too small")
+    return number
+
+
+class _Sampler:
+    """Draw the sample of one iteration, reusing the work buffers
+
+    'choice' uses Generator.choice, which runs Floyd's algorithm or a
+    partial Fisher-Yates shuffle in O(number), when at most half the rows
+    are sampled. Larger samples take the positions of the number smallest
+    random keys, an O(length) argpartition over a reused key buffer. Many
+    iterations at once redraw duplicates when at most an eighth of the rows
+    are sampled and use the random keys otherwise.
+    'integer' marks the drawn rows in a reused mask instead of sorting them
+    with np.unique and gives the same sorted indices. The weight methods
+    return per-row weights instead of indices.
+    """
+
+    def __init__(self, rng, length, number, sample_method, block_length=None):
+        self.rng = rng
+        self.length = length
+        self.number = number
+        self.sample_method = sample_method
+        self.block_length = block_length
+        self._keys = None
+        self._mask = None
+
+    def __call__(self):
+        if self.sample_method == "choice":
+            if 2 * self.number <= self.length:
+                return self.rng.choice(
+                    self.length, self.number, replace=False, shuffle=False
+                )
+            if self._keys is None:
+                self._keys = np.empty(self.length)
+            keys = self.rng.random(out=self._keys)
+            return np.argpartition(keys, self.number - 1)[: self.number]
+        elif self.sample_method == "integer":
+            if self._mask is None:
+                self._mask = np.empty(self.length, dtype=bool)
+            self._mask.fill(False)
+            self._mask[self.rng.integers(0, self.length, self.number)] = True
+            return np.flatnonzero(self._mask)
+        elif self.sample_method in _WEIGHT_METHODS:
+            return self.weight_matrix(1)[0]
+        elif self.sample_method in _BLOCK_METHODS:
+            return self.block_matrix(1)[0]
+        else:
+            return self.sample_method(self.length, self.number)
+
+    def matrix(self, iterations):
+        """Sample indices of many iterations at once, (iterations, number)"""
+        if self.sample_method == "choice" and 8 * self.number <= self.length:
+            return self.distinct_matrix(iterations)
+        elif self.sample_method == "choice":
+            # the positions of the number smallest random keys of each row
+            # are a uniform sample without replacement
+            keys = self.rng.random((iterations, self.length))
+            return np.argpartition(keys, self.number - 1, axis=1)[:, : self.number]
+        elif self.sample_method == "integer":
+            return self.rng.integers(0, self.length, (iterations, self.number))
+        elif self.sample_method in _WEIGHT_METHODS:
+            return self.weight_matrix(iterations)
+        elif self.sample_method in _BLOCK_METHODS:
+            return self.block_matrix(iterations)
+
+        idx = np.empty((iterations, self.number), dtype=np.intp)
+        for row in idx:
+            row[...] = self()
+        return idx
+
+    def distinct_matrix(self, iterations):
+        """Sorted samples without replacement for small numbers, O(number)
+
+        Draws with replacement and redraws the duplicates of the rows that
+        have any until every row is distinct. Which draws are redrawn does
+        not depend on their values, so each row is a uniform sample.
+        """
+        idx = self.rng.integers(0, self.length, (iterations, self.number))
+        idx.sort(axis=1)
+        rows = np.arange(iterations)
+        while len(rows):
+            sample = idx[rows]
+            duplicate = np.zeros(sample.shape, dtype=bool)
+            np.equal(sample[:, 1:], sample[:, :-1], out=duplicate[:, 1:])
+            redraw = duplicate.any(axis=1)
+            rows, sample, duplicate = rows[redraw], sample[redraw], duplicate[redraw]
+            sample[duplicate] = self.rng.integers(
+                0, self.length, np.count_nonzero(duplicate)
+            )
+            sample.sort(axis=1)
+            idx[rows] = sample
+        return idx
+
+    def block_matrix(self, iterations):
+        """Sample blocks of consecutive rows of many iterations at once"""
+        number, block_length = self.number, self.block_length
+        if self.sample_method == "moving_block":
+            blocks = -(-number // block_length)
+            starts = self.rng.integers(
+                0, self.length - block_length + 1, (iterations, blocks)
+            )
+            idx = starts[:, :, np.newaxis] + np.arange(block_length)
+            return idx.reshape(iterations, blocks * block_length)[:, :number]
+
+        # stationary: a block starts at every position with probability
+        # 1 / block_length, so the block lengths are geometric. Each position
+        # is the start of its block plus its distance to the block's first
+        # position, wrapping around the end of the data.
+        new = self.rng.random((iterations, number)) < 1 / block_length
+        new[:, 0] = True
+        position = np.arange(number)
+        first = np.maximum.accumulate(np.where(new, position, 0), axis=1)
+        starts = self.rng.integers(0, self.length, np.count_nonzero(new))
+        block = np.cumsum(new.ravel()).reshape(new.shape) - 1
+        return (starts[block] + (position - first)) % self.length
+
+    def weight_matrix(self, iterations):
+        """Draw per-row weights of many iterations, (iterations, length)"""
+        shape = (iterations, self.length)
+        if self.sample_method == "multinomial":
+            # counts of number rows drawn with replacement, one bincount over
+            # all iterations with the rows offset by iteration
+            idx = self.rng.integers(0, self.length, (iterations, self.number))
+            idx += np.arange(iterations)[:, None] * self.length
+            counts = np.bincount(idx.ravel(), minlength=iterations * self.length)
+            return counts.reshape(shape)
+        elif self.sample_method == "poisson":
+            return self.rng.poisson(self.number / self.length, shape)
+        else:
+            # Dirichlet(1, ..., 1) weights of the Bayesian bootstrap
+            weights = self.rng.standard_exponential(shape)
+            weights /= weights.sum(axis=1, keepdims=True)
+            return weights
+
+
+def _bootstrap_chunk(
+    data,
+    seed,
+    iterations,
+    func,
+    func_args,
+    func_kws,
+    length,
+    number,
+    sample_method,
+    vectorized,
+    batch_size,
+    block_length,
+):
+    """Run the iterations of one chunk with its own random stream"""
+    sampler = _Sampler(
+        np.random.default_rng(seed), length, number, sample_method, block_length
+    )
+    call = (func, func_args, func_kws, sample_method in _WEIGHT_METHODS)
+    if vectorized:
+        return _vectorized_results(data, sampler, iterations, batch_size, call)
+    return _iterated_results(data, sampler, iterations, call)
+
+
+def _vectorized_results(data, sampler, iterations, batch_size, call):
+    """Results of iterations evaluated in batches of one func call each"""
+    func, func_args, func_kws, weighted = call
+    batch_size = batch_size or iterations
+    bootstrap_results = []
+    for start in range(0, iterations, batch_size):
+        sample = sampler.matrix(min(batch_size, iterations - start))
+        if weighted:
+            samples = _broadcast_weight_matrix(data, sample)
+        else:
+            samples = (_take_rows(data, sample),)
+        res = func(*samples, *func_args, axis=1, **func_kws)
+        bootstrap_results.extend(res)
+    return bootstrap_results
+
+
+def _iterated_results(data, sampler, iterations, call):
+    """Results of iterations evaluated one func call each"""
+    func, func_args, func_kws, weighted = call
+    bootstrap_results = []
+    for _ in range(iterations):
+        sample = sampler()
+
+        if weighted:
+            res = func(data, sample, *func_args, **func_kws)
+        else:
+            res = func(_take_rows(data, sample), *func_args, **func_kws)
+
+        bootstrap_results.append(res)
+
+    return bootstrap_results
+
+
+def _columnar(data, columnar):
+    """data as _Columns if columnar and data is a DataFrame"""
+    if columnar and isinstance(data, pd.DataFrame):
+        return _Columns.from_frame(data)
+    return data
+
+
+def _length(data):
+    """Number of rows of data"""
+    return data.length if isinstance(data, _Columns) else len(data)
+
+
+def _take_rows(data, idx):
+    """Gather the rows idx of data"""
+    if isinstance(data, _Columns):
+        return data.take(idx)
+    elif isinstance(data, (pd.DataFrame, pd.Series)):
+        return data.iloc[idx]
+    return data[idx]
+
+
+class _Columns(Mapping):
+    """Read-only mapping of column name to numpy array of a sample
+
+    bootstrap(columnar=True) converts a DataFrame once with one to_numpy
+    per column and passes func this instead of data.iloc[idx]. A column is
+    gathered with one np.take the first time func reads it, so columns that
+    func does not use cost nothing. The weight methods in vectorized mode
+    read every column as a broadcast view of shape (iterations,) + column
+    shape instead.
+    """
+
+    def __init__(self, arrays, length, idx=None, iterations=None):
+        self._arrays = arrays
+        self._idx = idx
+        self._iterations = iterations
+        self._taken = {}
+        self.length = length
+
+    @classmethod
+    def from_frame(cls, df):
+        """Columns of a DataFrame"""
+        return cls({column: df[column].to_numpy() for column in df.columns}, len(df))
+
+    def take(self, idx):
+        """Sample of the rows idx, gathered lazily"""
+        if self._idx is not None:
+            idx = np.take(self._idx, idx)
+        return _Columns(self._arrays, len(idx), idx)
+
+    def broadcast(self, iterations):
+        """Columns viewed as (iterations,) + column shape"""
+        return _Columns(self._arrays, self.length, self._idx, iterations)
+
+    def __getitem__(self, column):
+        if self._idx is None:
+            values = self._arrays[column]
+        else:
+            if column not in self._taken:
+                self._taken[column] = np.take(self._arrays[column], self._idx, axis=0)
+            values = self._taken[column]
+        if self._iterations is None:
+            return values
+        return np.broadcast_to(values, (self._iterations,) + values.shape)
+
+    def __iter__(self):
+        return iter(self._arrays)
+
+    def __len__(self):
+        return len(self._arrays)
+
+
+def _broadcast_weight_matrix(data, weights):
+    """Views of data and weights broadcast to (iterations,) + data.shape
+
+    Columns are broadcast lazily with their weights left as they are.
+    """
+    if isinstance(data, _Columns):
+        return data.broadcast(len(weights)), weights
+    data = np.asarray(data)
+    shape = weights.shape + data.shape[1:]
+    weights = weights.reshape(weights.shape + (1,) * (data.ndim - 1))
+    return np.broadcast_to(data, shape), np.broadcast_to(weights, shape)
+
+
+def _map_chunks(data, chunks, options, n_jobs, run=_bootstrap_chunk):
+    """Yield run(data, seed, iterations, **options) of the (seed, iterations)
+    chunks in chunk order, serially or on a pool
+
+    Closing the generator early cancels the chunks that have not started.
+    """
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+    if not n_jobs or n_jobs == 1 or len(chunks) < 2:
+        for seed, iterations in chunks:
+            yield run(data, seed, iterations, **options)
+        return
+
+    shm = None
+    if isinstance(data, np.ndarray) and not data.dtype.hasobject:
+        # copy the array once into shared memory instead of pickling it
+        shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+        shared = np.ndarray(data.shape, data.dtype, buffer=shm.buf)
+        shared[...] = data
+        del shared
+        initargs = (None, (shm.name, data.shape, data.dtype))
+    else:
+        initargs = (data, None)
+
+    executor = ProcessPoolExecutor(n_jobs, initializer=_init_worker, initargs=initargs)
+    try:
+        # keep a few chunks per worker in flight so stopping early wastes
+        # little work
+        pending = deque()
+        for seed, iterations in chunks:
+            pending.append(executor.submit(_run_worker, run, seed, iterations, options))
+            if len(pending) >= 2 * n_jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+
+class _Convergence:
+    """Running Monte Carlo error of the bootstrap std or quantiles
+
+    The std error comes from shifted power sums of the results, the quantile
+    error from the exact quantiles of the results so far over the binomial
+    standard error of the quantile level.
+    """
+
+    def __init__(self, tolerance, quantiles, time_budget):
+        self.tolerance = tolerance
+        self.quantiles = None if quantiles is None else np.asarray(quantiles)
+        self.deadline = None
+        if time_budget is not None:
+            self.deadline = time.monotonic() + time_budget
+        self.count = 0
+        self.shift = None
+        self.sums = None
+        self.values = None
+
+    def update(self, results):
+        """Add the results of a chunk and return True once converged"""
+        values = np.asarray(results, dtype=float).reshape(len(results), -1)
+        values = values[np.isfinite(values).all(axis=1)]
+        if len(values):
+            if self.shift is None:
+                self.shift = values.mean(axis=0)
+                self.sums = np.zeros((4, values.shape[1]))
+                self.values = values[:0]
+            self.count += len(values)
+            if self.quantiles is None:
+                centered = values - self.shift
+                for power, total in enumerate(self.sums, 1):
+                    total += (centered**power).sum(axis=0)
+            else:
+                self.values = np.concatenate([self.values, values])
+
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return True
+        if self.tolerance is None or self.count < 2:
+            return False
+        return bool(np.all(self.error() <= self.tolerance))
+
+    def error(self):
+        """Monte Carlo standard error of each tracked statistic"""
+        if self.quantiles is not None:
+            delta = np.sqrt(self.quantiles * (1 - self.quantiles) / self.count)
+            lower = np.clip(self.quantiles - delta, 0, 1)
+            upper = np.clip(self.quantiles + delta, 0, 1)
+            spread = np.quantile(self.values, [upper, lower], axis=0)
+            return (spread[0] - spread[1]) / 2
+
+        # central moments from the raw moments about the shift
+        raw = self.sums / self.count
+        mean = raw[0]
+        m2 = raw[1] - mean**2
+        m4 = raw[3] - 4 * mean * raw[2] + 6 * mean**2 * raw[1] - 3 * mean**4
+        with np.errstate(divide="ignore", invalid="ignore"):
+            error = np.sqrt(np.maximum(m4 - m2**2, 0) / self.count) / (
+                2 * np.sqrt(m2)
+            )
+        return np.where(m2 > 0, error, 0.0)
+
+
+class _Checkpoint:
+    """Results of bootstrap chunks stored in a directory, see bootstrap"""
+
+    def __init__(self, path, seed, chunk_size, data, options):
+        self.path = path
+        self.metadata_path = os.path.join(path, "bootstrap.json")
+        os.makedirs(path, exist_ok=True)
+
+        entropy = np.random.SeedSequence(seed).entropy
+        # everything besides the seed that decides the samples of a chunk
+        sampling = {
+            "chunk_size": chunk_size,
+            "data": _fingerprint(data),
+            "sample_method": _method_name(options["sample_method"]),
+            "sample_size": options["number"],
+            "block_length": options["block_length"],
+            "vectorized": bool(options["vectorized"]),
+            "batch_size": options["batch_size"],
+        }
+        if os.path.exists(self.metadata_path):
+            with open(self.metadata_path, encoding="utf-8") as buffer:
+                self.metadata = json.load(buffer)
+            for key, value in sampling.items():
+                if self.metadata.get(key) != value:
+                    raise ValueError(f"checkpoint was written with another {key}")
+            if seed is not None and self.metadata["entropy"] != entropy:
+                raise ValueError("checkpoint was written with another seed")
+        else:
+            self.metadata = {"entropy": entropy, **sampling, "chunks": {}}
+            self._write_metadata()
+        self.seed_sequence = np.random.SeedSequence(self.metadata["entropy"])
+
+    def run(self, data, chunks, options, n_jobs, convergence):
+        """Load the stored chunks, run and store the others, in chunk order"""
+        stored = [
+            self.metadata["chunks"].get(str(index), {}).get("iterations") == iterations
+            for index, (_, iterations) in enumerate(chunks)
+        ]
+        missing = [chunk for chunk, done in zip(chunks, stored) if not done]
+        bootstrap_results = None
+        count = 0
+        with closing(_map_chunks(data, missing, options, n_jobs)) as chunk_results:
+            for index, done in enumerate(stored):
+                if done:
+                    results = np.load(self._chunk_path(index))
+                else:
+                    results = self._save(index, chunks[index], next(chunk_results))
+                bootstrap_results = _place(bootstrap_results, results, count, chunks)
+                count += len(results)
+                if convergence is not None and convergence.update(results):
+                    break
+        if bootstrap_results is None:
+            return np.empty(0)
+        return bootstrap_results[:count]
+
+    def _save(self, index, chunk, results):
+        """Store the results of a chunk, then record it in the metadata"""
+        results = np.asarray(results)
+        if results.dtype.kind not in "biufc":
+            raise ValueError("checkpoint_path needs numeric results")
+        # write to a temporary file first so a stored chunk is always complete
+        path = self._chunk_path(index)
+        with open(path + ".tmp", "wb") as buffer:
+            np.save(buffer, results)
+        os.replace(path + ".tmp", path)
+
+        seed, iterations = chunk
+        self.metadata["chunks"][str(index)] = {
+            "spawn_key": list(seed.spawn_key),
+            "iterations": iterations,
+        }
+        self._write_metadata()
+        return results
+
+    def _chunk_path(self, index):
+        return os.path.join(self.path, f"chunk_{index:06d}.npy")
+
+    def _write_metadata(self):
+        with open(self.metadata_path + ".tmp", "w", encoding="utf-8") as buffer:
+            json.dump(self.metadata, buffer)
+        os.replace(self.metadata_path + ".tmp", self.metadata_path)
+
+
+def _place(bootstrap_results, results, count, chunks):
+    """Write results at count into the preallocated results of all chunks"""
+    if bootstrap_results is None:
+        total = sum(iterations for _, iterations in chunks)
+        bootstrap_results = np.empty((total,) + results.shape[1:], dtype=results.dtype)
+    elif not np.can_cast(results.dtype, bootstrap_results.dtype):
+        # promote instead of casting, e.g. int chunks then floats
+        bootstrap_results = bootstrap_results.astype(
+            np.result_type(bootstrap_results, results)
+        )
+    bootstrap_results[count:][: len(results)] = results
+    return bootstrap_results
+
+
+def _fingerprint(data):
+    """SHA-256 of the values and shape of data, to recognize it again"""
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        hashes = pd.util.hash_pandas_object(data).to_numpy()
+    else:
+        hashes = pd.util.hash_array(np.ravel(data))
+    digest = hashlib.sha256(hashes.tobytes())
+    digest.update(str(np.shape(data)).encode())
+    return digest.hexdigest()
+
+
+def _method_name(sample_method):
+    """Name of a sample method, including the module of a callable"""
+    if callable(sample_method):
+        return f"{sample_method.__module__}.{sample_method.__qualname__}"
+    return sample_method
+
+
+_WORKER_STATE = {}
+
+
+def _init_worker(data, shared):
+    """Attach a worker process to the data, see _map_chunks"""
+    if shared is not None:
+        name, shape, dtype = shared
+        shm = shared_memory.SharedMemory(name=name)
+        data = np.ndarray(shape, dtype, buffer=shm.buf)
+        # keep the segment open as long as the worker lives
+        _WORKER_STATE["shm"] = shm
+    _WORKER_STATE["data"] = data
+
+
+def _run_worker(run, seed, iterations, options):
+    """Run one chunk on the data of the worker process"""
+    return run(_WORKER_STATE["data"], seed, iterations, **options)
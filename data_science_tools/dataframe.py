@@ -4,6 +4,8 @@
 import pandas as pd
 import numpy as np
 
+from .weighted import WeightedQuantileSketch
+
 __all__ = [
     "coalesce",
     "display_df",
@@ -16,6 +18,7 @@ __all__ = [
     "apply_row_number",
     "apply_series_method",
     "apply_window_func",
+    "profile_df",
 ]
 
 
@@ -508,3 +511,173 @@ def window_function(
         results_series.name = results.name
 
     return results_series
+
+
+# ####################### PROFILING ####################### #
+
+
+class _HyperLogLog:
+    """Approximate distinct count with HyperLogLog registers.
+
+    Relative standard error is about 1.04 / sqrt(2 ** precision).
+    """
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, values):
+        """Add a chunk of (non-null) values"""
+        if not len(values):
+            return
+        hashes = pd.util.hash_array(np.asarray(values))
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.intp)
+        # the next 32 bits after the register index, exact as float64
+        rest = (hashes << np.uint64(self.precision)) >> np.uint64(32)
+        _, bit_length = np.frexp(rest.astype(float))
+        rank = (33 - bit_length).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        """Merge another sketch of the same precision into this one"""
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        """Estimated number of distinct values"""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.exp2(-self.registers.astype(float)))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)
+        return int(round(estimate))
+
+
+class _ColumnProfile:
+    """Accumulates the one-pass statistics for a single column"""
+
+    def __init__(self, numeric, top_k, compression, hll_precision):
+        self.top_k = top_k
+        self.rows = 0
+        self.count = 0
+        # Welford mean and sum of squared deviations of numeric columns
+        self.moments = (0.0, 0.0)
+        self.digest = WeightedQuantileSketch(compression) if numeric else None
+        self.distinct = _HyperLogLog(hll_precision)
+        self.counts = pd.Series(dtype=float)
+
+    def update(self, series):
+        """Add a chunk of the column"""
+        values = series.dropna()
+        count = len(values)
+        previous = self.count
+        self.rows += len(series)
+        self.count += count
+        self.distinct.update(values.to_numpy())
+        self._update_top_k(values)
+        if self.digest is None or not count:
+            return
+
+        x = values.to_numpy(dtype=float)
+        # Chan et al. pairwise combination of Welford accumulators
+        chunk_mean = x.mean()
+        mean, m2 = self.moments
+        delta = chunk_mean - mean
+        m2 += np.sum((x - chunk_mean) ** 2) + delta**2 * previous * count / self.count
+        self.moments = (mean + delta * count / self.count, m2)
+        self.digest.update(x)
+
+    def _update_top_k(self, values):
+        counts = values.value_counts()
+        # keep a bounded number of candidates, heavy hitters survive
+        self.counts = (
+            self.counts.add(counts, fill_value=0)
+            .sort_values(ascending=False, kind="mergesort")
+            .iloc[: 10 * self.top_k]
+        )
+
+    def summary(self, quantiles):
+        """Compile the statistics as a dict"""
+        count = self.count
+        numeric = self.digest is not None
+        mean, m2 = self.moments
+        result = {
+            "count": count,
+            "null_fraction": (self.rows - count) / self.rows if self.rows else np.nan,
+            "min": self.digest.min if numeric and count else np.nan,
+            "max": self.digest.max if numeric and count else np.nan,
+            "mean": mean if numeric and count else np.nan,
+            "var": m2 / (count - 1) if numeric and count > 1 else np.nan,
+        }
+        if numeric:
+            values = self.digest.quantile(quantiles)
+        else:
+            values = np.full(len(quantiles), np.nan)
+        for quantile_limit, value in zip(quantiles, values):
+            result[f"p{quantile_limit * 100:g}"] = value
+        result["distinct_approx"] = self.distinct.count()
+        top = self.counts.iloc[: self.top_k]
+        result["top_k"] = list(zip(top.index, top.astype(int)))
+        return result
+
+
+def profile_df(
+    df_or_chunks,
+    quantiles=(0.25, 0.5, 0.75),
+    top_k=5,
+    compression=200,
+    hll_precision=14,
+    chunk_size=1_000_000,
+):
+    """Profile every column of a dataframe in a single pass.
+
+    Each chunk of rows is visited once and folded into streaming sketches so
+    the memory used is bounded regardless of the number of rows. Unlike
+    `df.describe()`, `df.nunique()` and `df.value_counts()` it never holds
+    exact distinct sets or sorts full columns.
+
+    Parameters:
+        df_or_chunks (Union[DataFrame, Iterable[DataFrame]]): The data to
+            profile. Either a dataframe, which is visited `chunk_size` rows at
+            a time, or an iterable of dataframe chunks such as
+            `pd.read_csv(..., chunksize=n)`.
+        quantiles (Sequence[float]): Approximate quantiles to compute for
+            numeric columns.
+        top_k (int): Number of most frequent values to report per column.
+        compression (int): Size of the quantile sketch. Larger values are more
+            accurate, especially near the median.
+        hll_precision (int): HyperLogLog precision. The relative error of the
+            distinct count is about 1.04 / sqrt(2 ** hll_precision).
+        chunk_size (int): Number of rows per chunk when given a dataframe.
+
+    Returns:
+        DataFrame: One row per column with count, null_fraction, min, max,
+            mean, var (Welford, ddof=1), approximate quantiles named like
+            'p50', distinct_approx and top_k as a list of (value, count). The
+            top_k counts are exact for values which stay among the most
+            frequent candidates across all chunks.
+    """
+    if isinstance(df_or_chunks, pd.DataFrame):
+        df = df_or_chunks
+        starts = range(0, max(len(df), 1), chunk_size)
+        chunks = (df.iloc[start:][:chunk_size] for start in starts)
+    else:
+        chunks = iter(df_or_chunks)
+
+    profiles = {}
+    for chunk in chunks:
+        for i, column in enumerate(chunk.columns):
+            series = chunk.iloc[:, i]
+            if column not in profiles:
+                numeric = pd.api.types.is_numeric_dtype(
+                    series
+                ) and not pd.api.types.is_bool_dtype(series)
+                profiles[column] = _ColumnProfile(
+                    numeric, top_k, compression, hll_precision
+                )
+            profiles[column].update(series)
+
+    return pd.DataFrame.from_dict(
+        {column: profile.summary(quantiles) for column, profile in profiles.items()},
+        orient="index",
+    )
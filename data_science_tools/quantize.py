@@ -20,13 +20,39 @@ def get_quantize_centers(values, centers=None):
     return np.asarray(centers)
 
 
-def quantize_values(values, centers=None):
+def get_uniform_step(centers):
+    """Get the lattice step if the centers are evenly spaced, otherwise None
+
+    Centers are uniform when they are exactly what ``np.linspace`` gives for
+    their first value, last value and length, which is what
+    ``get_quantize_centers`` produces by default.
+    """
+    centers = np.asarray(centers)
+    if centers.ndim != 1 or len(centers) < 2:
+        return None
+    start, stop = centers[0], centers[-1]
+    if not start < stop:
+        return None
+    lattice, step = np.linspace(start, stop, len(centers), retstep=True)
+    if np.array_equal(centers, lattice):
+        return step
+    return None
+
+
+def quantize_values(values, centers=None, uniform=None, out=None):
     """On a particular 1d latice, quantize points to nearest
 
     Args:
         values (ndarray[Float]): Array of values to quantize to the centers
         centers (ndarray[Float]): Center values to quantize to. If None it will
             attempt to get the centers from the values.
+        uniform (bool): Whether the centers are evenly spaced. Uniform centers
+            are quantized arithmetically in O(1) per value instead of with a
+            binary search over the midpoints. If None it is detected from the
+            centers.
+        out (ndarray[Float]): Optional float array with the shape of values to
+            write the result to. It may be values itself to quantize in place.
+            On a uniform lattice no temporary arrays of that shape are made.
 
     Returns:
         one of:
@@ -39,17 +65,33 @@ def quantize_values(values, centers=None):
                 Series same as values but quantized to centers. If values is
                 pd.Series. index == values.index
     """
-    nanmask = np.isnan(values)
     centers = get_quantize_centers(values, centers)
-    midpoints = (centers[1:] + centers[:-1]) * 0.5
-    idx = np.digitize(values, midpoints)
-    quant = centers[idx]
-    if np.any(nanmask):
-        try:
-            quant[nanmask] = np.nan
-        except ValueError:
-            quant = quant.astype(float)
-            quant[nanmask] = np.nan
+    step = None
+    if uniform is None:
+        step = get_uniform_step(centers)
+    elif uniform and len(centers) > 1:
+        step = (centers[-1] - centers[0]) / (len(centers) - 1)
+
+    if step is not None and out is not None:
+        quant = _quantize_uniform_out(np.asarray(values), centers, step, out)
+    else:
+        nanmask = np.isnan(values)
+        if step is None:
+            midpoints = (centers[1:] + centers[:-1]) * 0.5
+            idx = np.digitize(values, midpoints)
+        else:
+            idx = _uniform_index(np.asarray(values), centers[0], step, nanmask)
+            idx = np.clip(idx, 0, len(centers) - 1, out=idx).astype(np.intp)
+        quant = centers[idx]
+        if np.any(nanmask):
+            try:
+                quant[nanmask] = np.nan
+            except ValueError:
+                quant = quant.astype(float)
+                quant[nanmask] = np.nan
+        if out is not None:
+            out[...] = quant
+            quant = out
 
     if isinstance(values, pd.Series):
         return pd.Series(quant, index=values.index)
@@ -57,6 +99,32 @@ def quantize_values(values, centers=None):
         return quant
 
 
+def _uniform_index(values, start, step, nanmask):
+    """Nearest lattice index as floats; ties round up like np.digitize"""
+    idx = np.subtract(values, start, dtype=float)
+    idx /= step
+    idx += 0.5
+    np.floor(idx, out=idx)
+    idx[nanmask] = 0
+    return idx
+
+
+def _quantize_uniform_out(values, centers, step, out):
+    """Quantize to a uniform lattice in place in out. NaN propagates."""
+    last = len(centers) - 1
+    np.subtract(values, centers[0], out=out)
+    out /= step
+    out += 0.5
+    np.floor(out, out=out)
+    np.clip(out, 0, last, out=out)
+    at_last = out == last
+    out *= step
+    out += centers[0]
+    # the last linspace value is set exactly rather than computed
+    np.copyto(out, centers[-1], where=at_last)
+    return out
+
+
 def quantize_hist(values, centers=None):
     """Quantize values to 1d lattice near center points and aggregate count.
 
@@ -130,6 +198,48 @@ class QuantizeTest(unittest.TestCase):
         expected = pd.Series([1, 1, np.nan, 6, 1, np.nan, 6], index=index)
         pd.testing.assert_series_equal(actual, expected)
 
+    def test_get_uniform_step(self):
+        """test"""
+        self.assertEqual(get_uniform_step(np.linspace(-1, 2, 7)), 0.5)
+        self.assertEqual(get_uniform_step([1, 6]), 5)
+        self.assertIsNone(get_uniform_step([-5, 2, 10]))
+        self.assertIsNone(get_uniform_step([3]))
+
+    @staticmethod
+    def test_quantize_uniform():
+        """test"""
+        rng = np.random.default_rng(0)
+        values = rng.normal(size=1000)
+        values[::7] = np.nan
+        centers = get_quantize_centers(values, 13)
+        expected = quantize_values(values, centers, uniform=False)
+        np.testing.assert_array_equal(quantize_values(values, centers), expected)
+        actual = quantize_values(values, centers, out=np.empty_like(values))
+        np.testing.assert_array_equal(actual, expected)
+
+    @staticmethod
+    def test_quantize_uniform_ties():
+        """test"""
+        values = np.array([-1, 0.5, 1.5, 2.5, 3, 9])
+        expected = np.array([0, 1, 2, 3, 3, 3])
+        np.testing.assert_array_equal(quantize_values(values, [0, 1, 2, 3]), expected)
+        np.testing.assert_array_equal(
+            quantize_values(values, [0, 1, 2, 3], uniform=False), expected
+        )
+
+    def test_quantize_in_place(self):
+        """test"""
+        values = np.array([2, 2, np.nan, 5, 2, np.nan, 4])
+        actual = quantize_values(values, [1, 6], out=values)
+        self.assertIs(actual, values)
+        expected = np.array([1, 1, np.nan, 6, 1, np.nan, 6])
+        np.testing.assert_array_equal(values, expected)
+
+        values = np.array([-10, -4, 1, 1, 1, 20, 5, 5.9, 7, 7, 16, 17])
+        quantize_values(values, [-5, 2, 10], out=values)
+        expected = np.array([-5, -5, 2, 2, 2, 10, 2, 2, 10, 10, 10, 10])
+        np.testing.assert_array_equal(values, expected)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,15 +1,52 @@
 """ Tools to bootstrap function results and errors.
 """
+from contextlib import closing
+import itertools
+import math
+from statistics import NormalDist
+
 import pandas as pd
 import numpy as np
 
+from ._resampling import (
+    _WEIGHT_METHODS,
+    _Checkpoint,
+    _Columns,
+    _Convergence,
+    _Sampler,
+    _block_length,
+    _broadcast_weight_matrix,
+    _collect,
+    _columnar,
+    _length,
+    _map_chunks,
+    _sample_size,
+    _seeded_chunks,
+    _take_rows,
+)
 
 __all__ = [
     "bootstrap",
+    "bootstrap_quantiles",
     "bootstrap_stats",
+    "jackknife_mean",
+    "permutation_test",
 ]
 
 
+# bootstrap options of bootstrap_stats with by or stratify, with defaults
+_GROUPED_OPTIONS = {
+    "func_args": None,
+    "func_kws": None,
+    "bootstrap_iterations": 100,
+    "bootstrap_sample_size": 0.75,
+    "bootstrap_min_sample_size": 5,
+    "sample_method": "choice",
+    "vectorized_batch_size": None,
+    "seed": None,
+}
+
+
 def bootstrap(
     data,
     func,
@@ -19,7 +56,18 @@ def bootstrap(
     bootstrap_sample_size=0.75,
     bootstrap_min_sample_size=5,
     sample_method="choice",
-):
+    vectorized=False,
+    vectorized_batch_size=None,
+    seed=None,
+    n_jobs=None,
+    chunk_size=1000,
+    tolerance=None,
+    tolerance_quantiles=None,
+    time_budget=None,
+    block_length=None,
+    columnar=False,
+    checkpoint_path=None,
+):  # pylint: disable=too-many-locals
     """Bootstrap a sample.
 
     Randomly samples from x along axis=0, and apply a function for some number
@@ -27,6 +75,11 @@ def bootstrap(
 
     return [func(x[sample_idx]) for _ in range(bootstrap_iterations)]
 
+    The iterations are split into chunks of chunk_size and every chunk draws
+    from its own np.random.Generator seeded with a child of
+    np.random.SeedSequence(seed). The results for a fixed seed are therefore
+    the same whether the chunks run serially or on any number of workers.
+
     Parameters
         data (array-like or DataFrame): This is used to sample from along axis=0
             If it's a Pandas Dataframe then m.iloc[idx] where idx are the
@@ -40,90 +93,851 @@ def bootstrap(
             if float less then 1.0 it samples that fraction of the total
         bootstrap_min_sample_size (int): will error with less than this
             many measurements
-        sample_method ('choice', 'integer', callable): How to randomly sample
+        sample_method ('choice', 'integer', 'multinomial', 'poisson',
+            'bayesian', 'moving_block', 'stationary', callable): How to
+            randomly sample
             * 'choice':
-                * np.random.choice(np.arange(length), number, replace=False)
-                * always returns correct sample size but takes longer to eval
+                * rng.choice(length, number, replace=False)
+                * always returns correct sample size
             * 'integer':
-                * np.unique(np.random.randint(0, length, number))
-                * faster evaluation but will give < number desired
+                * np.unique(rng.integers(0, length, number))
+                * will give < number desired
             * callable:
                 * calls this function to return the index of sample
                 * callable(length: int, number: int)
+                * uses its own random state so it is not controlled by seed
+            * 'multinomial', 'poisson', 'bayesian':
+                * never copies the data, draws a weight per row instead and
+                  calls func(data, weights, *func_args, **func_kws) with a
+                  weight-aware statistic, e.g. data_science_tools.weighted
+                * 'multinomial': counts of number rows drawn with replacement
+                * 'poisson': independent Poisson(number / length) counts
+                * 'bayesian': Dirichlet(1, ..., 1) weights summing to 1
+                * number may be up to or above length
+            * 'moving_block', 'stationary':
+                * for autocorrelated series, concatenates blocks of
+                  block_length consecutive rows until number rows are drawn
+                * 'moving_block': blocks of fixed length at uniform starts
+                * 'stationary': blocks of geometric length with mean
+                  block_length that wrap around the end of the data
+                * number may be up to or above length
+        vectorized (bool): If True draw the sample indices of many iterations
+            as one (iterations, number) matrix, gather them into one array
+            and call func once per batch as
+            func(samples, *func_args, axis=1, **func_kws) where samples has
+            the shape (iterations, number) + data.shape[1:]. func must reduce
+            axis=1 and return one result per iteration, e.g. np.mean,
+            np.median or np.percentile. DataFrames are converted with
+            np.asarray. With 'integer' the rows keep repeated indices (sampled
+            with replacement) so every row has exactly number samples.
+            The weight methods call func(data, weights, *func_args, axis=1,
+            **func_kws) with read-only views of data and the
+            (iterations, length) weights both broadcast to
+            (iterations,) + data.shape, so data is not copied. A linear
+            statistic can evaluate all iterations as one matrix product,
+            e.g. weights @ data[0] for 1-D data.
+        vectorized_batch_size (int): Maximum number of iterations gathered
+            at once in vectorized mode to bound the memory. Default is all
+            iterations of a chunk.
+        seed (int): Seed of the np.random.SeedSequence the random streams of
+            the chunks are spawned from. Default None is fresh entropy.
+        n_jobs (int): Number of worker processes, -1 for all cpus. Default
+            None runs serially. Numpy data is shared with the workers
+            through shared memory, other data is sent once per worker. func
+            and sample_method must be picklable.
+        chunk_size (int): Number of iterations per random stream and per
+            unit of parallel work. The results for a fixed seed depend on it
+            but not on n_jobs.
+        tolerance (float): Adaptive mode, stop after the first chunk at
+            which the Monte Carlo standard error of the tracked statistics
+            of every result is at most tolerance, in the units of the
+            results. bootstrap_iterations becomes the maximum and the length
+            of the returned list is the number of iterations used. func must
+            return numbers or equal length arrays.
+        tolerance_quantiles (list[float]): Quantiles of the results tracked
+            by tolerance. Default None tracks the std of the results.
+        time_budget (float): Stop after the first chunk that ends more than
+            this many seconds after the start. Unlike tolerance the number
+            of iterations then depends on timing and not only on seed.
+        block_length (int): Mean block length of the block methods. Default
+            is round(length ** (1 / 3)).
+        columnar (bool): If True and data is a DataFrame it is converted
+            once to numpy arrays and func gets a read-only mapping of column
+            name to numpy array of the sample instead of data.iloc[idx].
+            Each column is gathered with one np.take when func first reads
+            it, avoiding the index and block manager of a new DataFrame.
+        checkpoint_path (str): Directory to store the results of every
+            finished chunk in, as chunk_<index>.npy, with the seed entropy
+            and spawn key of every chunk in bootstrap.json. Running again
+            with the same path resumes from the stored chunks, with seed
+            None reusing the stored entropy. A hash of the data, chunk_size
+            and the sampling options are stored too and must match. func
+            must return numbers or equal shape arrays, which are collected
+            into a preallocated array of their common dtype.
 
     Returns
         list[func(m, *func_args, **func_kws)] : A list of the results of
             evaluating the function <bootstrap_iterations> times with a
-            random sampling of <bootstrap_sample_size>
+            random sampling of <bootstrap_sample_size>. With checkpoint_path
+            an array of shape (iterations,) + result shape.
+    """
+
+    if chunk_size < 1:
+        raise ValueError("chunk_size should be at least 1")
+
+    convergence = None
+    if tolerance is not None or time_budget is not None:
+        convergence = _Convergence(tolerance, tolerance_quantiles, time_budget)
+
+    options = {
+        "func": func,
+        "func_args": func_args or [],
+        "func_kws": func_kws or {},
+        "length": len(data),
+        "number": _sample_size(
+            len(data), bootstrap_sample_size, bootstrap_min_sample_size, sample_method
+        ),
+        "sample_method": sample_method,
+        "vectorized": vectorized,
+        "batch_size": vectorized_batch_size,
+        "block_length": _block_length(len(data), block_length, sample_method),
+    }
+
+    seed_sequence = np.random.SeedSequence(seed)
+    checkpoint = None
+    if checkpoint_path is not None:
+        checkpoint = _Checkpoint(checkpoint_path, seed, chunk_size, data, options)
+        seed_sequence = checkpoint.seed_sequence
+
+    data = _columnar(data, columnar)
+    if vectorized and not isinstance(data, _Columns):
+        data = np.asarray(data)
+
+    chunks = _seeded_chunks(seed_sequence, bootstrap_iterations, chunk_size)
+    if checkpoint is None:
+        return _collect(data, chunks, options, n_jobs, convergence)
+    return checkpoint.run(data, chunks, options, n_jobs, convergence)
+
+
+def bootstrap_quantiles(
+    data,
+    quantile_limit,
+    bootstrap_iterations=100,
+    bootstrap_sample_size=None,
+    method="beta",
+    batch_size=None,
+    seed=None,
+):
+    """Bootstrap quantiles of a sample without sorting any resample.
+
+    The data is sorted once. A resample drawn with replacement is then
+    described by how often it draws each sorted position, so its order
+    statistics, and with them its quantiles, are found without sorting.
+    Same linear interpolation as np.quantile.
+
+    Parameters
+        data (array-like): values, flattened, NaN values are ignored
+        quantile_limit (float or array-like): quantiles between 0 and 1
+        bootstrap_iterations (int): number of resamples
+        bootstrap_sample_size (int): size of every resample, drawn with
+            replacement. Default is the number of values.
+        method ('beta', 'counts'):
+            * 'beta': draws only the needed order statistics of the
+              resample, as uniform order statistics from successive beta
+              variates, O(len(quantile_limit)) per resample
+            * 'counts': multinomial counts of the sorted positions and a
+              search of their cumulative sum, O(n) per resample
+        batch_size (int): Maximum number of resamples drawn at once with
+            'counts'. Default bounds the counts to about 1e7 elements.
+        seed (int): seed of np.random.default_rng
+
+    Returns
+        ndarray: (bootstrap_iterations,) + np.shape(quantile_limit)
+    """
+    if method not in ("counts", "beta"):
+        raise ValueError("method should be 'counts' or 'beta'")
+    quantile_limit = np.asarray(quantile_limit, dtype=float)
+    if np.any((quantile_limit < 0) | (quantile_limit > 1)):
+        raise ValueError("quantile_limit should be between 0 and 1")
+    values = np.asarray(data, dtype=float).ravel()
+    values = np.sort(values[~np.isnan(values)])
+    length = len(values)
+    number = length if bootstrap_sample_size is None else int(bootstrap_sample_size)
+    if length == 0 or number < 1:
+        raise ValueError("need at least one value and sample size")
+
+    fraction, ranks, inverse = _rank_brackets(quantile_limit.ravel(), number)
+    if method == "beta":
+        index = _order_statistic_index(
+            np.random.default_rng(seed), ranks, length, number, bootstrap_iterations
+        )
+    else:
+        index = _counts_index(
+            _Sampler(np.random.default_rng(seed), length, number, "multinomial"),
+            ranks,
+            bootstrap_iterations,
+            batch_size or max(1, 10_000_000 // length),
+        )
+
+    quantiles = _interpolate_brackets(values[index][:, inverse], fraction)
+    return quantiles.reshape((bootstrap_iterations,) + quantile_limit.shape)
+
+
+def _rank_brackets(quantile_limit, number):
+    """Ranks of the order statistics around every quantile of number values
+
+    Returns:
+        (fraction, ranks, inverse): the unique 0-based ranks, inverse gives
+            the lower ranks followed by the upper ranks and fraction is the
+            interpolation weight of the upper one.
+    """
+    position = quantile_limit * (number - 1)
+    lower = np.floor(position).astype(int)
+    upper = np.minimum(lower + 1, number - 1)
+    ranks, inverse = np.unique(np.concatenate([lower, upper]), return_inverse=True)
+    return position - lower, ranks, inverse
+
+
+def _interpolate_brackets(order_statistics, fraction):
+    """Interpolate between the lower and upper order statistics (columns)"""
+    k = len(fraction)
+    low, high = order_statistics[:, :k], order_statistics[:, k:]
+    return low + (high - low) * fraction
+
+
+def _counts_index(sampler, ranks, iterations, batch_size):
+    """Sorted positions of the ranks, from multinomial counts in batches"""
+    return np.concatenate(
+        [
+            _count_rank_index(
+                sampler.weight_matrix(min(batch_size, iterations - start)), ranks
+            )
+            for start in range(0, iterations, batch_size)
+        ]
+    )
+
+
+def _count_rank_index(counts, ranks):
+    """Sorted positions of the 0-based ranks of resamples given as counts"""
+    iterations, length = counts.shape
+    number = counts[0].sum()
+    # offset every row by its total so one search covers all rows
+    offsets = np.arange(iterations)[:, np.newaxis]
+    cumulative = np.cumsum(counts, axis=1) + offsets * number
+    targets = ranks + offsets * number
+    index = np.searchsorted(cumulative.ravel(), targets.ravel(), side="right")
+    return index.reshape(iterations, len(ranks)) - offsets * length
+
+
+def _order_statistic_index(rng, ranks, length, number, iterations):
+    """Sorted positions of the 0-based ranks of resamples of number draws
+
+    The k-th smallest of number uniform values is Beta(k, number - k + 1)
+    and given it the next needed one is beta distributed on the rest of
+    the interval. floor(length * uniform) is a uniform draw of a position.
+    """
+    uniform = np.zeros(iterations)
+    previous = 0
+    index = np.empty((iterations, len(ranks)), dtype=np.intp)
+    for i, rank in enumerate(ranks + 1):
+        uniform += (1 - uniform) * rng.beta(
+            rank - previous, number - rank + 1, iterations
+        )
+        index[:, i] = np.minimum((uniform * length).astype(np.intp), length - 1)
+        previous = rank
+    return index
+
+
+def permutation_test(
+    x,
+    y,
+    statistic=None,
+    n_permutations=10000,
+    alternative="two-sided",
+    exact=None,
+    batch_size=None,
+    seed=None,
+    n_jobs=None,
+    chunk_size=10000,
+):
+    """Permutation test of two samples.
+
+    Pools x and y along axis=0 and reassigns the rows to two groups of the
+    original sizes. The permuted rows of a whole batch are drawn as one
+    (permutations, rows) matrix and the statistic is evaluated on all of
+    them at once.
+
+    Parameters
+        x (array-like): first sample, rows along axis=0
+        y (array-like): second sample with the same trailing shape
+        statistic (callable): vectorized statistic(x, y, axis=1) of samples
+            of shape (permutations, rows) + trailing shape, returning one
+            result per permutation. Default is the difference in means.
+        n_permutations (int): number of random permutations
+        alternative ('two-sided', 'greater', 'less'): 'greater' tests if the
+            statistic of x and y is larger than by chance, 'two-sided'
+            compares absolute values.
+        exact (bool): If True evaluate every split of the rows, which
+            needs comb(len(x) + len(y), len(x)) evaluations. Default None
+            does so when that is at most n_permutations.
+        batch_size (int): Maximum number of permutations evaluated at
+            once. Default bounds the matrix to about 1e7 elements.
+        seed, n_jobs, chunk_size: as in bootstrap, the results for a fixed
+            seed do not depend on n_jobs. statistic must be picklable with
+            n_jobs.
+
+    Returns
+        tuple(observed, pvalue): statistic(x, y) and its p-value. Random
+            permutations count the observed split, (count + 1) / (n + 1).
+    """
+    if alternative not in ("two-sided", "greater", "less"):
+        raise ValueError("alternative should be 'two-sided', 'greater' or 'less'")
+    x, y = np.asarray(x), np.asarray(y)
+    pooled = np.concatenate([x, y])
+    statistic = statistic or _mean_difference
+    splits = math.comb(len(pooled), len(x))
+    if exact is None:
+        exact = splits <= n_permutations
+    if exact:
+        n_permutations = splits
+    chunks = _permutation_chunks(n_permutations, exact, seed, chunk_size)
+
+    observed = statistic(x[np.newaxis], y[np.newaxis], axis=1)[0]
+    count = _null_count(
+        pooled,
+        chunks,
+        {
+            "statistic": statistic,
+            "n_x": len(x),
+            "batch_size": batch_size or max(1, 10_000_000 // pooled.size),
+            "exact": exact,
+        },
+        n_jobs,
+        (observed, alternative),
+    )
+    if exact:
+        return observed, count / splits
+    return observed, (count + 1) / (n_permutations + 1)
+
+
+def _permutation_chunks(n_permutations, exact, seed, chunk_size):
+    """(seed, iterations) of every chunk, seed is the first split if exact"""
+    if exact:
+        starts = range(0, n_permutations, chunk_size)
+        return [(start, min(chunk_size, n_permutations - start)) for start in starts]
+    return _seeded_chunks(np.random.SeedSequence(seed), n_permutations, chunk_size)
+
+
+def _null_count(pooled, chunks, options, n_jobs, test):
+    """Number of null statistics of all chunks at least as extreme
+
+    test is (observed, alternative).
     """
+    count = 0
+    with closing(
+        _map_chunks(pooled, chunks, options, n_jobs, run=_permutation_chunk)
+    ) as null_results:
+        for null in null_results:
+            count += _count_extreme(null, *test)
+    return count
+
+
+def _mean_difference(x, y, axis):
+    """Difference in means, the default statistic of permutation_test"""
+    return np.mean(x, axis=axis) - np.mean(y, axis=axis)
+
+
+def _count_extreme(null, observed, alternative):
+    """Number of null statistics at least as extreme as observed"""
+    # tolerate the rounding of statistics that equal the observed one
+    tolerance = 1e-12 * np.maximum(np.abs(observed), 1)
+    if alternative == "greater":
+        extreme = null >= observed - tolerance
+    elif alternative == "less":
+        extreme = null <= observed + tolerance
+    else:
+        extreme = np.abs(null) >= np.abs(observed) - tolerance
+    return extreme.sum(axis=0)
 
-    length = len(data)
-    if bootstrap_sample_size < 1.0:
-        number = int(length * bootstrap_sample_size)  # sample_size
+
+def _permutation_chunk(pooled, seed, iterations, statistic, n_x, batch_size, exact):
+    """Null statistics of a chunk of random permutations or exact splits
+
+    In the exact mode seed is the index of the first split of the chunk.
+    """
+    length = len(pooled)
+    if exact:
+        splits = itertools.islice(
+            itertools.combinations(range(length), n_x), seed, seed + iterations
+        )
     else:
-        number = int(bootstrap_sample_size)
-
-    # if the number requested is larger than the length just return all the
-    # indicies
-    if number >= length:
-        raise ValueError("sample size is larger then length")
-    elif number < bootstrap_min_sample_size:
-        raise ValueError("sample size is too small")
-    if not callable(sample_method) and sample_method not in ("choice", "integer"):
-        raise ValueError("sample_method should be 'choice' or 'integer'")
-
-    func_args = func_args or []
-    func_kws = func_kws or {}
-
-    bootstrap_results = []
-    for _ in range(bootstrap_iterations):
-        # decide which method to use
-        if sample_method == "choice":
-            idx = np.random.choice(np.arange(length), number, replace=False)
-        elif sample_method == "integer":
-            idx = np.unique(np.random.randint(0, length, number))
-        elif callable(sample_method):
-            idx = sample_method(length, number)
-
-        if isinstance(data, (pd.DataFrame, pd.Series)):
-            res = func(data.iloc[idx], *func_args, **func_kws)
+        rng = np.random.default_rng(seed)
+        buffer = np.empty((min(batch_size, iterations), length), dtype=np.intp)
+
+    null = []
+    for start in range(0, iterations, batch_size):
+        size = min(batch_size, iterations - start)
+        if exact:
+            idx = _split_index(itertools.islice(splits, size), size, n_x, length)
         else:
-            res = func(data[idx], *func_args, **func_kws)
+            # shuffle every row of the reused buffer independently
+            idx = buffer[:size]
+            idx[...] = np.arange(length)
+            rng.permuted(idx, axis=1, out=idx)
+        null.append(statistic(pooled[idx[:, :n_x]], pooled[idx[:, n_x:]], axis=1))
+    return np.concatenate(null)
 
-        bootstrap_results.append(res)
 
-    return bootstrap_results
+def _split_index(splits, size, n_x, length):
+    """Row order of every split, rows of x first then the rows of y in order"""
+    x_rows = np.fromiter(
+        itertools.chain.from_iterable(splits), dtype=np.intp, count=size * n_x
+    ).reshape(size, n_x)
+    in_x = np.zeros((size, length), dtype=bool)
+    np.put_along_axis(in_x, x_rows, True, axis=1)
+    return np.argsort(~in_x, axis=1, kind="stable")
 
 
-def bootstrap_stats(data, func, *args, **kwargs):
+def bootstrap_stats(
+    data,
+    func,
+    *args,
+    confidence_levels=(),
+    interval="percentile",
+    jackknife=None,
+    by=None,
+    stratify=None,
+    **kwargs,
+):
     """Runs bootstrap function and then compiles the results in aggregate.
 
+    The results are sorted once and every percentile and interval is
+    interpolated from that sorted array.
+
     Parameters
         data (array-like or DataFrame): This is used to sample from along axis=0
             If it's a Pandas Dataframe then m.iloc[idx] where idx are the
             integers used for sampling.
         func (callable): callable function whose first argument is data.
         *args, **kwargs: passed to bootstrap function
+        confidence_levels (list[float]): Levels of two-sided intervals to add
+            as lower_<percent> and upper_<percent> columns,
+            e.g. 0.9 adds lower_90 and upper_90.
+        interval ('percentile', 'bca'): 'percentile' takes the quantiles of
+            the results. 'bca' corrects them for bias and skew, with the
+            bias from the fraction of results below y and the acceleration
+            from the leave-one-out (jackknife) values of func.
+        jackknife (callable): jackknife(data) returning the n leave-one-out
+            values of func as an (n,) or (n, columns) array, used by 'bca'.
+            Default evaluates func n times. Statistics that are sums over
+            rows can do it in O(n), e.g. jackknife_mean.
+        by (str or list[str]): Columns of a DataFrame to bootstrap every
+            group of at once, see below.
+        stratify (str or list[str]): Columns of a DataFrame whose strata
+            are resampled separately, keeping their share of the sample.
+
+    With by or stratify the rows are sorted once by group and stratum and
+    the samples of all groups are drawn together with offset arithmetic,
+    'choice' without and 'integer' with replacement. A fractional
+    bootstrap_sample_size is the fraction of every stratum, an integer the
+    sample size of every group split among its strata by their share.
+    Groups too small for 'choice' are left out. The other columns are the values
+    and func is vectorized, func(samples, *func_args, axis=1, **func_kws)
+    with samples of shape (iterations, group sample size, value columns).
+    np.sum and np.mean run as one segmented reduction over all groups,
+    other functions once per group. Groups whose sample is smaller than
+    bootstrap_min_sample_size are left out. Only interval='percentile' is
+    supported, as are only the bootstrap options func_args, func_kws,
+    bootstrap_iterations, bootstrap_sample_size, bootstrap_min_sample_size,
+    sample_method, vectorized_batch_size and seed. vectorized_batch_size
+    defaults to bound the samples of a batch to about 1e7 elements. The
+    result is indexed by the group keys and value column.
 
     Returns
         DataFrame: aggregate metrics of bootstrap results.
     """
+    if interval not in ("percentile", "bca"):
+        raise ValueError("interval should be 'percentile' or 'bca'")
+    if by is not None or stratify is not None:
+        _check_grouped_options(interval, kwargs)
+        options = {**_GROUPED_OPTIONS, **dict(zip(_GROUPED_OPTIONS, args)), **kwargs}
+        return _grouped_bootstrap_stats(
+            data, func, by, stratify, confidence_levels, options
+        )
+
     kwargs["func"] = func
     try:
         bootstrap_results = pd.DataFrame(bootstrap(data, *args, **kwargs))
     except ValueError:
         return pd.DataFrame()
+    return _summary_stats(
+        data,
+        bootstrap_results,
+        kwargs,
+        confidence_levels,
+        interval=interval,
+        jackknife=jackknife,
+    )
+
+
+def _summary_stats(
+    data, bootstrap_results, kwargs, confidence_levels, *, interval, jackknife
+):
+    """Aggregate the bootstrap results of bootstrap_stats"""
+    # the arguments of _evaluate and _jackknife after the data
+    evaluation = (
+        kwargs["func"],
+        kwargs.get("func_args") or [],
+        kwargs.get("func_kws") or {},
+        kwargs.get("sample_method", "choice"),
+        kwargs.get("vectorized", False),
+    )
+    columns_data = _columnar(data, kwargs.get("columnar", False))
+    y = _evaluate(columns_data, None, *evaluation)
+
+    columns = bootstrap_results.columns
+    sorted_results = np.sort(bootstrap_results.dropna().to_numpy(float), axis=0)
+    stats = {
+        "p10": _sorted_quantile(sorted_results, 0.1),
+        "p50": _sorted_quantile(sorted_results, 0.5),
+        "p90": _sorted_quantile(sorted_results, 0.9),
+    }
+    stats = {key: pd.Series(value, index=columns) for key, value in stats.items()}
+    stats["std"] = bootstrap_results.std()
+    stats["mean"] = bootstrap_results.mean()
+    stats["y"] = y
+
+    if len(confidence_levels):
+        levels = np.asarray(confidence_levels, dtype=float)
+        alphas = np.concatenate([(1 - levels) / 2, (1 + levels) / 2])
+        if interval == "bca":
+            alphas = _bca_alphas(
+                sorted_results,
+                pd.DataFrame({"y": y}, index=columns)["y"].to_numpy(float),
+                _leave_one_out(data, columns_data, evaluation, jackknife),
+                alphas,
+            )
+        bounds = _interval_bounds(sorted_results, levels, alphas)
+        stats.update(
+            {name: pd.Series(bound, index=columns) for name, bound in bounds.items()}
+        )
+
+    return pd.DataFrame(stats)
+
+
+def _leave_one_out(data, columns_data, evaluation, jackknife):
+    """Leave-one-out values as (n, columns), evaluated n times by default"""
+    if jackknife is None:
+        leave_one_out = _jackknife(columns_data, *evaluation)
+    else:
+        leave_one_out = np.asarray(jackknife(data), dtype=float)
+    return leave_one_out.reshape(len(leave_one_out), -1)
+
+
+def _interval_bounds(sorted_results, levels, alphas):
+    """Interval bounds at the quantiles alphas, by column name"""
+    return {
+        name: _sorted_quantile(sorted_results, alpha)
+        for name, alpha in zip(_interval_names(levels), alphas)
+    }
+
+
+def _check_grouped_options(interval, kwargs):
+    """Raise a ValueError for the options by and stratify do not support"""
+    if interval != "percentile":
+        raise ValueError("by and stratify support only interval='percentile'")
+    unsupported = set(kwargs) - set(_GROUPED_OPTIONS)
+    if unsupported:
+        raise ValueError(
+            f"by and stratify do not support {sorted(unsupported)}, "
+            f"the supported options are {list(_GROUPED_OPTIONS)}"
+        )
+
+
+def _interval_names(levels):
+    """Column names of the interval bounds, lower ones first"""
+    return [
+        f"{bound}_{100 * level:g}" for bound in ("lower", "upper") for level in levels
+    ]
+
+
+def _grouped_bootstrap_stats(data, func, by, stratify, confidence_levels, options):
+    """bootstrap_stats of every group at once, see bootstrap_stats(by=...)"""
+    if options["sample_method"] not in ("choice", "integer"):
+        raise ValueError("by and stratify need sample_method 'choice' or 'integer'")
+    keys = [] if by is None else [by] if isinstance(by, str) else list(by)
+    strata = [] if stratify is None else [stratify]
+    if stratify is not None and not isinstance(stratify, str):
+        strata = list(stratify)
+    value_columns = data.columns.drop(keys + strata)
+
+    cells = _sorted_cells(data, keys, strata, value_columns)
+    cells["sizes"] = _cell_sample_sizes(
+        options["bootstrap_sample_size"],
+        options["sample_method"],
+        cells["cell_sizes"],
+        cells["cell_group"],
+    )
+    # the samples are laid out cell by cell, so every group is a slice
+    groups = _group_slices(cells["cell_group"], cells["sizes"])
+    groups["kept"] = np.flatnonzero(
+        groups["sizes"] >= max(options["bootstrap_min_sample_size"], 1)
+    )
+    if not len(groups["kept"]):
+        return pd.DataFrame()
 
-    func_args = kwargs.get("func_args", [])
-    func_kws = kwargs.get("func_kws", {})
+    results = _grouped_samples(func, cells, groups, options)
+    # the full data is laid out the same way with every row of every cell
+    y = _reduce_groups(
+        func,
+        cells["values"][np.newaxis],
+        groups=_group_slices(cells["cell_group"], cells["cell_sizes"], groups["kept"]),
+        func_args=options["func_args"] or [],
+        func_kws=options["func_kws"] or {},
+    ).reshape(-1)
 
     return pd.DataFrame(
-        {
-            "p10": bootstrap_results.dropna().quantile(0.1),
-            "p50": bootstrap_results.dropna().quantile(0.5),
-            "p90": bootstrap_results.dropna().quantile(0.9),
-            "std": bootstrap_results.std(),
-            "mean": bootstrap_results.mean(),
-            "y": func(data, *func_args, **func_kws),
-        }
+        _grouped_summary(results, y, confidence_levels),
+        index=_grouped_index(data, keys, groups["kept"], value_columns),
+    )
+
+
+def _sorted_cells(data, keys, strata, value_columns):
+    """Values sorted once by group and stratum, every cell is a group and stratum
+
+    Returns:
+        dict: values, the sorted cell of every row and the size, start and
+            group of every cell.
+    """
+    cell = _ngroup(data, keys + strata)
+    order = np.argsort(cell, kind="stable")
+    cell_sizes = np.bincount(cell)
+    cell_starts = np.cumsum(cell_sizes) - cell_sizes
+    return {
+        "values": data[value_columns].to_numpy()[order],
+        "cell": cell[order],
+        "cell_sizes": cell_sizes,
+        "cell_starts": cell_starts,
+        "cell_group": _ngroup(data, keys)[order][cell_starts],
+    }
+
+
+def _group_slices(cell_group, sizes, kept=None):
+    """Start and size of every group of cells laid out one after the other"""
+    group_sizes = np.bincount(cell_group, weights=sizes).astype(int)
+    return {
+        "starts": np.cumsum(group_sizes) - group_sizes,
+        "sizes": group_sizes,
+        "kept": kept,
+    }
+
+
+def _grouped_samples(func, cells, groups, options):
+    """func of the samples of the kept groups, (iterations, groups * columns)
+
+    The default batch bounds the sample matrices, and with 'choice' the
+    (iterations, rows) sort keys, to about 1e7 elements.
+    """
+    iterations = options["bootstrap_iterations"]
+    width = max(len(cells["cell"]), cells["sizes"].sum(), 1) * max(
+        cells["values"].shape[1], 1
     )
+    batch_size = options["vectorized_batch_size"] or max(1, 10_000_000 // width)
+    rng = np.random.default_rng(options["seed"])
+    results = []
+    for start in range(0, iterations, batch_size):
+        idx = _cell_sample_matrix(
+            rng, cells, min(batch_size, iterations - start), options["sample_method"]
+        )
+        results.append(
+            _reduce_groups(
+                func,
+                cells["values"][idx],
+                groups=groups,
+                func_args=options["func_args"] or [],
+                func_kws=options["func_kws"] or {},
+            )
+        )
+    return np.concatenate(results).reshape(iterations, -1)
+
+
+def _grouped_summary(results, y, confidence_levels):
+    """Aggregate the (iterations, groups * columns) grouped results"""
+    sorted_results = np.sort(results, axis=0)
+    stats = {
+        "p10": _sorted_quantile(sorted_results, 0.1),
+        "p50": _sorted_quantile(sorted_results, 0.5),
+        "p90": _sorted_quantile(sorted_results, 0.9),
+        "std": np.nanstd(results, axis=0, ddof=1),
+        "mean": np.nanmean(results, axis=0),
+        "y": y,
+    }
+    if len(confidence_levels):
+        levels = np.asarray(confidence_levels, dtype=float)
+        alphas = np.concatenate([(1 - levels) / 2, (1 + levels) / 2])
+        stats.update(_interval_bounds(sorted_results, levels, alphas))
+    return stats
+
+
+def _grouped_index(data, keys, kept, value_columns):
+    """Index of the grouped stats, the kept group keys and value column"""
+    if not keys:
+        return value_columns
+    groups = data.groupby(keys, sort=True, dropna=False).size().index[kept]
+    return pd.MultiIndex.from_tuples(
+        [
+            (*(key if isinstance(key, tuple) else (key,)), column)
+            for key in groups
+            for column in value_columns
+        ],
+        names=keys + [None],
+    )
+
+
+def _ngroup(data, keys):
+    """Sorted group numbers of the rows, all zero without keys"""
+    if not keys:
+        return np.zeros(len(data), dtype=np.intp)
+    return data.groupby(keys, sort=True, dropna=False).ngroup().to_numpy()
+
+
+def _cell_sample_sizes(bootstrap_sample_size, sample_method, cell_sizes, cell_group):
+    """Sample size of every cell, keeping the share of its group
+
+    A fraction applies to every cell. An integer is the sample size of every
+    group, split among its cells. 'choice' leaves out the groups it cannot
+    sample without replacement by giving them no rows.
+    """
+    if bootstrap_sample_size <= 0:
+        raise ValueError("bootstrap_sample_size should be positive")
+    if bootstrap_sample_size < 1:
+        return (cell_sizes * bootstrap_sample_size).astype(int)
+    group_rows = np.bincount(cell_group, weights=cell_sizes)[cell_group]
+    fraction = int(bootstrap_sample_size) / group_rows
+    if sample_method == "choice":
+        fraction[fraction >= 1] = 0
+    return (cell_sizes * fraction).astype(int)
+
+
+def _cell_sample_matrix(rng, cells, iterations, sample_method):
+    """Sample sizes[c] sorted rows from every cell c, (iterations, sizes.sum())"""
+    sizes = cells["sizes"]
+    offsets = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    if sample_method == "integer":
+        sample_cell = np.repeat(np.arange(len(sizes)), sizes)
+        draws = rng.random((iterations, len(sample_cell)))
+        return cells["cell_starts"][sample_cell] + (
+            draws * cells["cell_sizes"][sample_cell]
+        ).astype(np.intp)
+    # sorting cell + uniform key shuffles the rows within their cells, the
+    # first sizes[c] positions of every cell are a sample without replacement
+    keys = cells["cell"] + rng.random((iterations, len(cells["cell"])))
+    return np.argsort(keys, axis=1)[:, np.repeat(cells["cell_starts"], sizes) + offsets]
+
+
+def _reduce_groups(func, samples, groups, func_args, func_kws):
+    """Reduce the samples of every kept group, (iterations, groups, columns)"""
+    starts, sizes, kept = groups["starts"], groups["sizes"], groups["kept"]
+    if func in (np.sum, np.mean) and not func_args and not func_kws:
+        # the groups tile the samples, reduceat every non-empty one at once
+        nonempty = np.flatnonzero(sizes)
+        totals = np.add.reduceat(samples, starts[nonempty], axis=1)
+        totals = totals[:, np.searchsorted(nonempty, kept)]
+        if func is np.mean:
+            totals = totals / sizes[kept].reshape((1, -1) + (1,) * (samples.ndim - 2))
+        return totals
+    ends = starts + sizes
+    return np.stack(
+        [
+            func(samples[:, start:end], *func_args, axis=1, **func_kws)
+            for start, end in zip(starts[kept], ends[kept])
+        ],
+        axis=1,
+    )
+
+
+def jackknife_mean(data):
+    """Leave-one-out means of data along axis=0 in O(n)
+
+    Use as bootstrap_stats(data, np.mean, jackknife=jackknife_mean).
+    """
+    values = np.asarray(data, dtype=float)
+    return (values.sum(axis=0) - values) / (len(values) - 1)
+
+
+def _evaluate(data, rows, func, func_args, func_kws, sample_method, vectorized):
+    """Evaluate func like an iteration on the rows (boolean mask) of data
+
+    rows None is the full data.
+    """
+    if sample_method in _WEIGHT_METHODS:
+        weights = np.ones(_length(data)) if rows is None else rows.astype(float)
+        if vectorized:
+            samples = _broadcast_weight_matrix(data, weights[np.newaxis])
+            return func(*samples, *func_args, axis=1, **func_kws)[0]
+        return func(data, weights, *func_args, **func_kws)
+
+    if rows is not None:
+        data = _take_rows(data, np.flatnonzero(rows))
+    if vectorized:
+        if isinstance(data, _Columns):
+            data = data.take(np.arange(data.length)[np.newaxis])
+        else:
+            data = np.asarray(data)[np.newaxis]
+        return func(data, *func_args, axis=1, **func_kws)[0]
+    return func(data, *func_args, **func_kws)
+
+
+def _jackknife(data, func, func_args, func_kws, sample_method, vectorized):
+    """Leave-one-out values of func, evaluated n times"""
+    rows = np.ones(_length(data), dtype=bool)
+    results = []
+    for i in range(_length(data)):
+        rows[i] = False
+        results.append(
+            _evaluate(data, rows, func, func_args, func_kws, sample_method, vectorized)
+        )
+        rows[i] = True
+    return pd.DataFrame(results).to_numpy(float)
+
+
+def _sorted_quantile(sorted_values, q):
+    """Linear quantiles of the columns of sorted values, q per column"""
+    count, columns = sorted_values.shape
+    q = np.broadcast_to(q, (columns,))
+    if count == 0:
+        return np.full(columns, np.nan)
+    position = q * (count - 1)
+    valid = np.isfinite(position)
+    lower = np.floor(np.where(valid, position, 0)).astype(int)
+    upper = np.minimum(lower + 1, count - 1)
+    index = np.arange(columns)
+    low = sorted_values[lower, index]
+    result = low + (sorted_values[upper, index] - low) * (position - lower)
+    return np.where(valid, result, np.nan)
+
+
+def _bca_alphas(sorted_results, theta, leave_one_out, alphas):
+    """Bias corrected and accelerated quantile levels, (len(alphas), columns)"""
+    normal = NormalDist()
+    cdf = np.vectorize(normal.cdf, otypes=[float])
+    ppf = np.vectorize(normal.inv_cdf, otypes=[float])
+
+    # bias from the fraction of results below the full sample value, counting
+    # ties as half so constant results have no bias
+    below = (sorted_results < theta).sum(axis=0)
+    ties = (sorted_results == theta).sum(axis=0)
+    fraction = (below + 0.5 * ties) / max(len(sorted_results), 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bias = ppf(np.clip(fraction, 1e-12, 1 - 1e-12))
+
+        # acceleration from the skew of the jackknife values
+        deviation = leave_one_out.mean(axis=0) - leave_one_out
+        acceleration = (deviation**3).sum(axis=0) / (
+            6 * ((deviation**2).sum(axis=0)) ** 1.5
+        )
+    acceleration = np.where(np.isfinite(acceleration), acceleration, 0.0)
+
+    z_alpha = ppf(alphas)[:, np.newaxis]
+    z = bias + (bias + z_alpha) / (1 - acceleration * (bias + z_alpha))
+    return cdf(z)
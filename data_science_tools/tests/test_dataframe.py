@@ -365,5 +365,52 @@ class TestMergeOnIndex(unittest.TestCase):
         pd.testing.assert_frame_equal(actual, expected)
 
 
+class TestProfileDf(unittest.TestCase):
+    """Test profile_df"""
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        self.df = pd.DataFrame(
+            {
+                "value": rng.normal(size=20000),
+                "category": rng.choice(["a", "b", "c"], 20000, p=[0.5, 0.3, 0.2]),
+            }
+        )
+        self.df.loc[::4, "value"] = np.nan
+
+    def test_profile_df_exact_moments(self):
+        actual = dataframe.profile_df(self.df, chunk_size=3000)
+        value = self.df["value"]
+        self.assertEqual(actual.loc["value", "count"], value.count())
+        self.assertAlmostEqual(actual.loc["value", "null_fraction"], 0.25)
+        self.assertAlmostEqual(actual.loc["value", "min"], value.min())
+        self.assertAlmostEqual(actual.loc["value", "max"], value.max())
+        self.assertAlmostEqual(actual.loc["value", "mean"], value.mean())
+        self.assertAlmostEqual(actual.loc["value", "var"], value.var())
+
+    def test_profile_df_approximate(self):
+        actual = dataframe.profile_df(self.df, chunk_size=3000)
+        value = self.df["value"]
+        for quantile_limit in (0.25, 0.5, 0.75):
+            name = f"p{quantile_limit * 100:g}"
+            self.assertAlmostEqual(
+                actual.loc["value", name], value.quantile(quantile_limit), places=1
+            )
+        distinct = actual.loc["value", "distinct_approx"]
+        self.assertLess(abs(distinct - value.nunique()) / value.nunique(), 0.05)
+        self.assertEqual(actual.loc["category", "distinct_approx"], 3)
+        self.assertListEqual(
+            actual.loc["category", "top_k"],
+            list(self.df["category"].value_counts().items()),
+        )
+
+    def test_profile_df_chunks(self):
+        chunks = (self.df.iloc[start:][:5000] for start in range(0, 20000, 5000))
+        actual = dataframe.profile_df(chunks)
+        expected = dataframe.profile_df(self.df)
+        pd.testing.assert_series_equal(actual["count"], expected["count"])
+        pd.testing.assert_series_equal(actual["mean"], expected["mean"])
+
+
 if __name__ == "__main__":
     unittest.main()
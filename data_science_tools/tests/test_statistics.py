@@ -3,12 +3,14 @@
 # pylint: disable=missing-function-docstring,missing-class-docstring
 # pylint: disable=invalid-name,no-self-use
 
+import os
+import tempfile
 import unittest
 
 import numpy as np
 import pandas as pd
 
-from data_science_tools import statistics
+from data_science_tools import statistics, weighted
 
 
 class TestBootstrap(unittest.TestCase):
@@ -99,6 +101,135 @@ class TestBootstrap(unittest.TestCase):
         # first three are [0, 1, 2, 3, 4] so mean is 2
         self.assertListEqual(results, [2 for _ in range(4)])
 
+    def test_bootstrap_vectorized_mean(self):
+        data = np.arange(10.0)
+
+        def sample_method(_, number):
+            return np.arange(0, number)
+
+        results = statistics.bootstrap(
+            data,
+            np.mean,
+            bootstrap_sample_size=5,
+            bootstrap_iterations=7,
+            sample_method=sample_method,
+            vectorized=True,
+            vectorized_batch_size=3,
+        )
+        self.assertListEqual(results, [2 for _ in range(7)])
+
+    def test_bootstrap_vectorized_choice_unique(self):
+        data = np.arange(20)
+
+        def func(samples, axis):
+            return np.sort(samples, axis=axis)
+
+        results = statistics.bootstrap(
+            data,
+            func,
+            bootstrap_sample_size=15,
+            bootstrap_iterations=5,
+            vectorized=True,
+        )
+        for result in results:
+            self.assertEqual(len(np.unique(result)), 15)
+
+    def test_bootstrap_vectorized_2d(self):
+        data = np.ones((20, 3))
+        results = statistics.bootstrap(
+            data, np.mean, bootstrap_iterations=4, vectorized=True
+        )
+        np.testing.assert_array_equal(results, np.ones((4, 3)))
+
+    def test_bootstrap_choice_unique(self):
+        data = np.arange(100)
+        for size in (10, 90):
+            for vectorized in (False, True):
+                results = statistics.bootstrap(
+                    data,
+                    np.unique if not vectorized else np.sort,
+                    bootstrap_sample_size=size,
+                    bootstrap_iterations=3,
+                    vectorized=vectorized,
+                )
+                for result in results:
+                    self.assertEqual(len(np.unique(result)), size)
+
+    def test_bootstrap_vectorized_choice_uniform(self):
+        data = np.arange(50)
+        results = statistics.bootstrap(
+            data,
+            lambda x, axis: x,
+            bootstrap_sample_size=5,
+            bootstrap_iterations=20000,
+            vectorized=True,
+            seed=0,
+        )
+        for result in results:
+            self.assertEqual(len(np.unique(result)), 5)
+        counts = np.bincount(np.ravel(results), minlength=50)
+        np.testing.assert_allclose(counts / 20000, 0.1, atol=0.01)
+
+    def test_bootstrap_integer_sorted_unique(self):
+        data = np.arange(100)
+        results = statistics.bootstrap(
+            data, lambda x: x, bootstrap_iterations=3, sample_method="integer"
+        )
+        for result in results:
+            np.testing.assert_array_equal(result, np.unique(result))
+
+    def test_bootstrap_weights(self):
+        data = pd.DataFrame({"a": np.arange(20.0)})
+
+        def func(df, weights):
+            self.assertIs(df, data)
+            return weights.sum()
+
+        for sample_method, expected in [("multinomial", 30), ("bayesian", 1)]:
+            results = statistics.bootstrap(
+                data,
+                func,
+                bootstrap_sample_size=30,
+                bootstrap_iterations=3,
+                sample_method=sample_method,
+            )
+            np.testing.assert_allclose(results, expected)
+
+    def test_bootstrap_weights_vectorized(self):
+        data = np.ones((20, 2))
+        for sample_method in ("multinomial", "poisson", "bayesian"):
+            results = statistics.bootstrap(
+                data,
+                weighted.mean,
+                bootstrap_iterations=4,
+                sample_method=sample_method,
+                vectorized=True,
+            )
+            np.testing.assert_allclose(results, np.ones((4, 2)))
+
+    def test_bootstrap_seed(self):
+        data = np.arange(100.0)
+        kws = {"bootstrap_iterations": 10, "chunk_size": 3}
+        results = statistics.bootstrap(data, np.mean, seed=1, **kws)
+        self.assertListEqual(
+            results, statistics.bootstrap(data, np.mean, seed=1, **kws)
+        )
+        self.assertNotEqual(results, statistics.bootstrap(data, np.mean, seed=2, **kws))
+
+    def test_bootstrap_n_jobs(self):
+        data = np.random.normal(size=(100, 2))
+        kws = {"bootstrap_iterations": 10, "chunk_size": 3, "seed": 1}
+        expected = statistics.bootstrap(data, np.mean, **kws)
+        results = statistics.bootstrap(data, np.mean, n_jobs=2, **kws)
+        np.testing.assert_array_equal(results, expected)
+
+    def test_bootstrap_n_jobs_dataframe(self):
+        data = pd.DataFrame(np.random.normal(size=(100, 2)))
+        kws = {"bootstrap_iterations": 4, "chunk_size": 2, "seed": 1}
+        expected = statistics.bootstrap(data, np.mean, **kws)
+        results = statistics.bootstrap(data, np.mean, n_jobs=2, **kws)
+        np.testing.assert_array_equal(results, expected)
+
     def test_bootstrap_stats(self):
         def func(_):
             return np.arange(3)
@@ -128,3 +259,391 @@ class TestBootstrap(unittest.TestCase):
             ],
         )
         pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+    def test_bootstrap_stats_intervals(self):
+        data = np.random.exponential(size=100)
+        kws = {
+            "bootstrap_iterations": 200,
+            "seed": 0,
+            "confidence_levels": [0.8, 0.95],
+        }
+        result = statistics.bootstrap_stats(data, np.mean, **kws)
+        results = np.array(
+            statistics.bootstrap(data, np.mean, bootstrap_iterations=200, seed=0)
+        )
+        np.testing.assert_allclose(
+            result.loc[0, ["lower_80", "upper_80", "lower_95", "upper_95"]],
+            np.quantile(results, [0.1, 0.9, 0.025, 0.975]),
+        )
+        self.assertAlmostEqual(result.loc[0, "p10"], np.quantile(results, 0.1))
+
+    def test_bootstrap_stats_bca_jackknife(self):
+        data = pd.DataFrame(np.random.exponential(size=(50, 2)))
+        kws = {
+            "bootstrap_iterations": 200,
+            "seed": 0,
+            "confidence_levels": [0.9],
+            "interval": "bca",
+        }
+        expected = statistics.bootstrap_stats(data, pd.DataFrame.mean, **kws)
+        result = statistics.bootstrap_stats(
+            data, pd.DataFrame.mean, jackknife=statistics.jackknife_mean, **kws
+        )
+        pd.testing.assert_frame_equal(result, expected)
+        self.assertTrue((result["lower_90"] < result["upper_90"]).all())
+
+    def test_bootstrap_tolerance(self):
+        data = np.random.default_rng(0).normal(size=100)
+        kws = {"bootstrap_iterations": 10000, "chunk_size": 50, "seed": 0}
+        results = statistics.bootstrap(data, np.mean, tolerance=0.005, **kws)
+        self.assertLess(len(results), 10000)
+        self.assertEqual(len(results) % 50, 0)
+        self.assertLessEqual(np.std(results) / np.sqrt(2 * len(results)), 0.006)
+        # stops at the same chunk for any number of workers
+        self.assertListEqual(
+            results,
+            statistics.bootstrap(data, np.mean, tolerance=0.005, n_jobs=2, **kws),
+        )
+        self.assertListEqual(
+            results, statistics.bootstrap(data, np.mean, **kws)[: len(results)]
+        )
+
+    def test_bootstrap_tolerance_quantiles(self):
+        data = np.random.default_rng(0).normal(size=(100, 2))
+        results = statistics.bootstrap(
+            data,
+            np.mean,
+            bootstrap_iterations=10000,
+            chunk_size=100,
+            tolerance=0.01,
+            tolerance_quantiles=[0.1, 0.9],
+            seed=0,
+        )
+        self.assertLess(len(results), 10000)
+
+    def test_bootstrap_time_budget(self):
+        results = statistics.bootstrap(
+            np.ones(10), np.mean, bootstrap_iterations=10**6, time_budget=0
+        )
+        self.assertEqual(len(results), 1000)
+
+    def test_bootstrap_moving_block(self):
+        data = np.arange(30)
+        for vectorized in (False, True):
+            results = statistics.bootstrap(
+                data,
+                (lambda x, axis: x) if vectorized else (lambda x: x),
+                bootstrap_sample_size=30,
+                bootstrap_iterations=3,
+                sample_method="moving_block",
+                block_length=5,
+                vectorized=vectorized,
+            )
+            for result in results:
+                self.assertEqual(len(result), 30)
+                blocks = np.reshape(result, (6, 5))
+                np.testing.assert_array_equal(np.diff(blocks, axis=1), 1)
+
+    def test_bootstrap_stationary(self):
+        data = np.arange(30)
+        results = statistics.bootstrap(
+            data,
+            lambda x, axis: x,
+            bootstrap_sample_size=40,
+            bootstrap_iterations=20,
+            sample_method="stationary",
+            block_length=5,
+            vectorized=True,
+        )
+        results = np.array(results)
+        self.assertEqual(results.shape, (20, 40))
+        steps = np.diff(results, axis=1)
+        # blocks continue with the next row, wrapping around the end
+        continued = (steps == 1) | (steps == -29)
+        self.assertTrue(0.6 < continued.mean() < 0.9)
+
+    def test_bootstrap_block_length(self):
+        with self.assertRaises(ValueError):
+            statistics.bootstrap(
+                np.arange(10), np.mean, sample_method="moving_block", block_length=11
+            )
+
+    def test_bootstrap_stats_by(self):
+        data = pd.DataFrame(
+            {
+                "group": np.repeat(["a", "b", "c"], [40, 60, 3]),
+                "x": np.random.normal(size=103),
+            }
+        )
+        for func in (np.mean, np.median):
+            result = statistics.bootstrap_stats(
+                data, func, by="group", confidence_levels=[0.9], seed=0
+            )
+            # group c is smaller than bootstrap_min_sample_size
+            self.assertListEqual(list(result.index), [("a", "x"), ("b", "x")])
+            expected = data.groupby("group")["x"].agg(func)
+            np.testing.assert_allclose(result["y"], expected[["a", "b"]])
+            self.assertTrue((result["lower_90"] <= result["p50"]).all())
+            self.assertTrue((result["p50"] <= result["upper_90"]).all())
+
+    def test_bootstrap_stats_stratify(self):
+        strata = np.repeat([0, 1], [30, 70])
+        data = pd.DataFrame({"stratum": strata, "is_one": strata == 1})
+        result = statistics.bootstrap_stats(
+            data, np.mean, stratify="stratum", bootstrap_sample_size=0.5
+        )
+        # every sample keeps 15 rows of stratum 0 and 35 of stratum 1
+        self.assertAlmostEqual(result.loc["is_one", "std"], 0)
+        self.assertAlmostEqual(result.loc["is_one", "mean"], 0.7)
+
+    def test_bootstrap_stats_by_sample_count(self):
+        strata = np.repeat([0, 1, 0, 1], [20, 80, 10, 10])
+        data = pd.DataFrame(
+            {
+                "group": np.repeat(["a", "b"], [100, 20]),
+                "stratum": strata,
+                "is_one": strata == 1,
+            }
+        )
+        result = statistics.bootstrap_stats(
+            data,
+            np.mean,
+            by="group",
+            stratify="stratum",
+            bootstrap_sample_size=50,
+            seed=0,
+        )
+        # group b is too small for 50 rows without replacement
+        self.assertListEqual(list(result.index), [("a", "is_one")])
+        # every sample keeps 10 rows of stratum 0 and 40 of stratum 1
+        self.assertAlmostEqual(result.loc[("a", "is_one"), "std"], 0)
+        self.assertAlmostEqual(result.loc[("a", "is_one"), "mean"], 0.8)
+
+    def test_bootstrap_stats_by_batches(self):
+        data = pd.DataFrame(
+            {"group": np.repeat(["a", "b"], [30, 20]), "x": np.arange(50.0)}
+        )
+        result = statistics.bootstrap_stats(
+            data,
+            np.mean,
+            by="group",
+            bootstrap_iterations=10,
+            vectorized_batch_size=3,
+            seed=0,
+        )
+        expected = statistics.bootstrap_stats(
+            data, np.mean, by="group", bootstrap_iterations=10, seed=0
+        )
+        pd.testing.assert_index_equal(result.index, expected.index)
+        self.assertFalse(result.isna().any().any())
+        np.testing.assert_allclose(result["y"], [14.5, 39.5])
+
+    def test_bootstrap_stats_by_unsupported_option(self):
+        data = pd.DataFrame({"group": ["a"] * 10, "x": np.arange(10.0)})
+        with self.assertRaisesRegex(ValueError, "n_jobs"):
+            statistics.bootstrap_stats(data, np.mean, by="group", n_jobs=2)
+
+    def test_bootstrap_columnar(self):
+        data = pd.DataFrame(
+            {"a": np.random.normal(size=50), "b": np.arange(50), "c": ["x"] * 50}
+        )
+
+        def func(sample):
+            return sample["a"].mean() + sample["b"].max()
+
+        kws = {"bootstrap_iterations": 5, "seed": 0}
+        results = statistics.bootstrap(data, func, columnar=True, **kws)
+        np.testing.assert_allclose(results, statistics.bootstrap(data, func, **kws))
+
+        def keys(sample):
+            self.assertIsInstance(sample["b"], np.ndarray)
+            return list(sample)
+
+        results = statistics.bootstrap(data, keys, columnar=True, **kws)
+        self.assertListEqual(results[0], ["a", "b", "c"])
+
+    def test_bootstrap_columnar_vectorized_weights(self):
+        data = pd.DataFrame({"a": np.arange(20.0), "c": ["x"] * 20})
+
+        def func(sample, weights, axis):
+            return (sample["a"] * weights).sum(axis=axis) / weights.sum(axis=axis)
+
+        def func_array(sample, weights, axis):
+            return np.average(sample[..., 0], weights=weights[..., 0], axis=axis)
+
+        kws = {
+            "bootstrap_iterations": 5,
+            "sample_method": "multinomial",
+            "vectorized": True,
+            "seed": 0,
+        }
+        results = statistics.bootstrap(data, func, columnar=True, **kws)
+        expected = statistics.bootstrap(data[["a"]].to_numpy(), func_array, **kws)
+        np.testing.assert_allclose(results, expected)
+        result = statistics.bootstrap_stats(data, func, columnar=True, **kws)
+        self.assertAlmostEqual(result.loc[0, "y"], data["a"].mean())
+
+    def test_bootstrap_stats_columnar(self):
+        data = pd.DataFrame({"a": np.random.normal(size=50)})
+        result = statistics.bootstrap_stats(
+            data, lambda sample: sample["a"].mean(), columnar=True
+        )
+        self.assertAlmostEqual(result.loc[0, "y"], data["a"].mean())
+
+    def test_bootstrap_checkpoint(self):
+        data = np.random.normal(size=(100, 2))
+        calls = []
+
+        def func(sample):
+            calls.append(1)
+            if len(calls) == 25:
+                raise KeyboardInterrupt
+            return sample.mean(axis=0)
+
+        kws = {"bootstrap_iterations": 50, "chunk_size": 10, "seed": 3}
+        with tempfile.TemporaryDirectory() as path:
+            with self.assertRaises(KeyboardInterrupt):
+                statistics.bootstrap(data, func, checkpoint_path=path, **kws)
+            self.assertTrue(os.path.exists(os.path.join(path, "chunk_000001.npy")))
+            self.assertFalse(os.path.exists(os.path.join(path, "chunk_000002.npy")))
+
+            # resumes after the two stored chunks
+            results = statistics.bootstrap(data, func, checkpoint_path=path, **kws)
+            self.assertEqual(len(calls), 25 + 30)
+            self.assertIsInstance(results, np.ndarray)
+            np.testing.assert_array_equal(
+                results,
+                statistics.bootstrap(data, np.mean, func_kws={"axis": 0}, **kws),
+            )
+
+            with self.assertRaises(ValueError):
+                statistics.bootstrap(
+                    data, func, checkpoint_path=path, **{**kws, "seed": 4}
+                )
+            for changed in (
+                {"sample_method": "integer"},
+                {"bootstrap_sample_size": 0.5},
+            ):
+                with self.assertRaisesRegex(ValueError, "checkpoint"):
+                    statistics.bootstrap(
+                        data, func, checkpoint_path=path, **{**kws, **changed}
+                    )
+            with self.assertRaisesRegex(ValueError, "checkpoint"):
+                statistics.bootstrap(data + 1, func, checkpoint_path=path, **kws)
+
+    def test_bootstrap_checkpoint_promotes_dtype(self):
+        kws = {"chunk_size": 2, "seed": 0}
+        with tempfile.TemporaryDirectory() as path:
+            # the stored first chunk has integers, the second floats
+            statistics.bootstrap(
+                np.arange(10),
+                lambda sample: 1,
+                bootstrap_iterations=2,
+                checkpoint_path=path,
+                **kws,
+            )
+            results = statistics.bootstrap(
+                np.arange(10),
+                lambda sample: 1.5,
+                bootstrap_iterations=4,
+                checkpoint_path=path,
+                **kws,
+            )
+            np.testing.assert_array_equal(results, [1, 1, 1.5, 1.5])
+            stored = np.load(os.path.join(path, "chunk_000001.npy"))
+            np.testing.assert_array_equal(stored, [1.5, 1.5])
+
+
+class TestPermutationTest(unittest.TestCase):
+    """Test permutation_test"""
+
+    def test_permutation_test_exact(self):
+        x = np.array([1.0, 2.0, 3.0])
+        y = np.array([4.0, 5.0, 6.0, 7.0])
+        observed, pvalue = statistics.permutation_test(x, y, alternative="less")
+        self.assertAlmostEqual(observed, -3.5)
+        # only the observed split of the 35 has the three smallest in x
+        self.assertAlmostEqual(pvalue, 1 / 35)
+        _, pvalue = statistics.permutation_test(x, y)
+        self.assertAlmostEqual(pvalue, 2 / 35)
+
+    def test_permutation_test_random(self):
+        rng = np.random.default_rng(0)
+        x = rng.normal(1, 1, size=50)
+        y = rng.normal(0, 1, size=60)
+        kws = {"n_permutations": 2000, "seed": 0, "chunk_size": 500}
+        observed, pvalue = statistics.permutation_test(x, y, **kws)
+        self.assertAlmostEqual(observed, x.mean() - y.mean())
+        self.assertLess(pvalue, 0.01)
+        self.assertTupleEqual(
+            (observed, pvalue), statistics.permutation_test(x, y, n_jobs=2, **kws)
+        )
+
+    def test_permutation_test_statistic(self):
+        x = np.random.normal(size=(20, 2))
+        y = np.random.normal(size=(20, 2))
+
+        def median_difference(a, b, axis):
+            return np.median(a, axis=axis) - np.median(b, axis=axis)
+
+        observed, pvalue = statistics.permutation_test(
+            x, y, median_difference, n_permutations=200
+        )
+        np.testing.assert_allclose(observed, median_difference(x, y, axis=0))
+        self.assertTrue(((0 < pvalue) & (pvalue <= 1)).all())
+
+
+class TestBootstrapQuantiles(unittest.TestCase):
+    """Test bootstrap_quantiles"""
+
+    def test_bootstrap_quantiles_constant(self):
+        for method in ("beta", "counts"):
+            results = statistics.bootstrap_quantiles(
+                np.full(10, 3.0), [0.1, 0.5], 4, method=method
+            )
+            np.testing.assert_array_equal(results, np.full((4, 2), 3.0))
+
+    def test_bootstrap_quantiles_distribution(self):
+        rng = np.random.default_rng(0)
+        data = rng.exponential(size=101)
+        quantile_limit = [0.1, 0.5, 0.9]
+        expected = np.array(
+            [
+                np.quantile(rng.choice(data, len(data)), quantile_limit)
+                for _ in range(2000)
+            ]
+        )
+        for method in ("beta", "counts"):
+            results = statistics.bootstrap_quantiles(
+                data, quantile_limit, 2000, method=method, seed=0
+            )
+            self.assertEqual(results.shape, (2000, 3))
+            np.testing.assert_allclose(
+                results.mean(axis=0), expected.mean(axis=0), rtol=0.05
+            )
+            np.testing.assert_allclose(
+                results.std(axis=0), expected.std(axis=0), rtol=0.2
+            )
+
+    def test_bootstrap_quantiles_counts_rank(self):
+        data = np.arange(5.0) * 10
+        # the quantiles k / 5 of a resample of 6 are its order statistics
+        results = statistics.bootstrap_quantiles(
+            data,
+            np.linspace(0, 1, 6),
+            bootstrap_iterations=2000,
+            bootstrap_sample_size=6,
+            method="counts",
+            seed=0,
+        )
+        np.testing.assert_allclose(results, np.round(results, -1), atol=1e-9)
+        self.assertTrue((np.diff(results, axis=1) >= 0).all())
+        # P(minimum >= data[k]) = ((5 - k) / 5) ** 6
+        expected = 10 * sum(((5 - k) / 5) ** 6 for k in range(1, 5))
+        self.assertAlmostEqual(results[:, 0].mean(), expected, delta=0.5)
+
+    def test_bootstrap_quantiles_shape(self):
+        results = statistics.bootstrap_quantiles(np.arange(10.0), 0.5, 3)
+        self.assertEqual(results.shape, (3,))
+        with self.assertRaises(ValueError):
+            statistics.bootstrap_quantiles(np.arange(10.0), 1.5, 3)
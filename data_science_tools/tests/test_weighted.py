@@ -6,6 +6,9 @@
 
 import unittest
 
+import numpy as np
+import pandas as pd
+
 from data_science_tools import weighted
 
 
@@ -32,6 +35,440 @@ class TestWeighted(unittest.TestCase):
         actual = weighted.median([1, 1, 2, 3, 3], [0, 0, 1, 1, 1])
         self.assertEqual(actual, 3.0)
 
+    def test_median_matches_quantile_with_ties_and_nan(self):
+        data = [2, 2, 0, 0, np.nan, np.nan]
+        weights = [2, 2, 1, 2, 1, 2]
+        actual = weighted.median(data, weights)
+        self.assertEqual(actual, weighted.quantile(data, weights, 0.5))
+        self.assertEqual(actual, 1.5)
+
+    def test_quantile_2d_matches_quantile_1d(self):
+        rng = np.random.default_rng(0)
+        data = rng.integers(0, 10, (20, 15)).astype(float)
+        data[rng.random(data.shape) < 0.2] = np.nan
+        data[3] = np.nan
+        weights = rng.random(15)
+        for quantile_limit in (0.0, 0.1, 0.5, 0.75, 1.0):
+            actual = weighted.quantile(data, weights, quantile_limit)
+            expected = [
+                weighted.quantile_1d(row, weights, quantile_limit) for row in data
+            ]
+            np.testing.assert_allclose(actual, expected)
+
+    def test_quantile_1d_many_quantiles(self):
+        rng = np.random.default_rng(1)
+        data = rng.random(50)
+        weights = rng.random(50)
+        quantile_limits = np.array([0.05, 0.25, 0.5, 0.75, 0.95])
+        actual = weighted.quantile_1d(data, weights, quantile_limits)
+        expected = [weighted.quantile_1d(data, weights, q) for q in quantile_limits]
+        np.testing.assert_array_equal(actual, expected)
+
+    def test_quantile_many_quantiles_shape(self):
+        data = np.arange(24.0).reshape((2, 3, 4))
+        actual = weighted.quantile(data, np.ones(4), [0.0, 0.5, 1.0])
+        self.assertEqual(actual.shape, (3, 2, 3))
+        np.testing.assert_allclose(actual[1], np.median(data, axis=-1))
+
+    def test_quantile_axis(self):
+        rng = np.random.default_rng(2)
+        data = rng.random((4, 5, 6))
+        weights = rng.random(5)
+        actual = weighted.quantile(data, weights, 0.3, axis=1)
+        expected = [
+            [weighted.quantile_1d(data[i, :, k], weights, 0.3) for k in range(6)]
+            for i in range(4)
+        ]
+        np.testing.assert_allclose(actual, expected)
+
+    def test_quantile_axis_full_weights(self):
+        rng = np.random.default_rng(3)
+        data = rng.random((4, 5))
+        weights = rng.random((4, 5))
+        actual = weighted.quantile(data, weights, 0.3, axis=0)
+        expected = [
+            weighted.quantile_1d(data[:, j], weights[:, j], 0.3) for j in range(5)
+        ]
+        np.testing.assert_allclose(actual, expected)
+
+    def test_quantile_axis_tuple(self):
+        data = np.random.default_rng(4).random((4, 5, 6))
+        actual = weighted.median(data, np.ones((4, 6)), axis=(0, 2))
+        np.testing.assert_allclose(actual, np.median(data, axis=(0, 2)))
+        actual = weighted.median(data, np.ones(data.shape), axis=None)
+        self.assertAlmostEqual(actual, np.median(data))
+
+    def test_quantile_axis_weights_mismatch(self):
+        with self.assertRaises(TypeError):
+            weighted.quantile(np.ones((4, 5)), np.ones(3), 0.5, axis=0)
+
+    def test_quantile_float32(self):
+        rng = np.random.default_rng(12)
+        data = rng.random((10, 30))
+        weights = rng.random(30)
+        actual = weighted.quantile(data.astype(np.float32), weights, [0.25, 0.5])
+        self.assertEqual(actual.dtype, np.float32)
+        expected = weighted.quantile(data, weights, [0.25, 0.5])
+        np.testing.assert_allclose(actual, expected, rtol=1e-5)
+
+    def test_quantile_out_and_work(self):
+        rng = np.random.default_rng(13)
+        data = rng.random((10, 30))
+        data[0, :5] = np.nan
+        work = np.empty(3 * data.size)
+        out = np.empty((2, 10))
+        for weights in (rng.random(30), rng.random((10, 30))):
+            actual = weighted.quantile(data, weights, [0.1, 0.9], out=out, work=work)
+            self.assertIs(actual, out)
+            expected = [
+                [weighted.quantile_1d(row, w, q) for row, w in zip(data, weights_2d)]
+                for q in (0.1, 0.9)
+                for weights_2d in [np.broadcast_to(weights, data.shape)]
+            ]
+            np.testing.assert_allclose(actual, expected)
+
+    def test_quantile_float32_long_row(self):
+        # a float32 sum of the weights stops growing at 2**24
+        data = np.random.default_rng(14).random(20_000_000).astype(np.float32)
+        actual = weighted.quantile(data, np.ones(data.size), [0.5, 0.9])
+        self.assertEqual(actual.dtype, np.float32)
+        np.testing.assert_allclose(actual, [0.5, 0.9], atol=1e-3)
+        data = np.arange(4, dtype=np.float32)
+        actual = weighted.quantile(data, [2.0**24, 1, 1, 2.0**24], 0.5)
+        self.assertEqual(actual, 1.5)
+
+    def test_quantile_out_mismatch(self):
+        data = np.random.default_rng(15).random((3, 5))
+        with self.assertRaises(ValueError):
+            weighted.quantile(data, np.ones(5), 0.5, out=np.zeros((4, 3)))
+        with self.assertRaises(ValueError):
+            weighted.quantile(data, np.ones(5), 0.5, out=np.zeros(3, np.float32))
+
+    def test_quantile_work_too_small(self):
+        with self.assertRaises(ValueError):
+            weighted.quantile(np.ones((3, 4)), np.ones(4), 0.5, work=np.empty(10))
+
+    def test_quantile_select_1d_matches_quantile_1d(self):
+        rng = np.random.default_rng(5)
+        data = rng.random(5000)
+        data[rng.random(5000) < 0.1] = np.nan
+        weights = rng.random(5000)
+        quantile_limits = [0.0, 0.01, 0.25, 0.5, 0.9, 1.0]
+        actual = weighted.quantile_select_1d(data, weights, quantile_limits)
+        expected = weighted.quantile_1d(data, weights, quantile_limits)
+        np.testing.assert_allclose(actual, expected)
+
+    def test_quantile_select_1d_all_nan(self):
+        actual = weighted.quantile_select_1d([np.nan, np.nan], [1, 1], 0.5)
+        self.assertTrue(np.isnan(actual))
+
+    def test_quantile_out_of_range(self):
+        with self.assertRaises(ValueError):
+            weighted.quantile_1d([1, 2], [1, 1], [0.5, 1.5])
+
+    def test_quantile_3d_shape(self):
+        data = np.arange(24.0).reshape((2, 3, 4))
+        actual = weighted.quantile(data, np.ones(4), 0.5)
+        np.testing.assert_allclose(actual, np.median(data, axis=-1))
+
+
+class TestWeightedMoments(unittest.TestCase):
+    """Unit tests for weighted moments and histogram"""
+
+    def setUp(self):
+        rng = np.random.default_rng(10)
+        self.data = rng.normal(size=(3, 40))
+        # integer frequency weights are the same as repeating the data
+        self.weights = rng.integers(1, 5, 40)
+        self.repeated = np.repeat(self.data, self.weights, axis=1)
+
+    def test_var_std_frequency(self):
+        np.testing.assert_allclose(
+            weighted.var(self.data, self.weights, axis=1, ddof=1),
+            self.repeated.var(axis=1, ddof=1),
+        )
+        np.testing.assert_allclose(
+            weighted.std(self.data, self.weights, axis=-1),
+            self.repeated.std(axis=1),
+        )
+
+    def test_var_reliability(self):
+        weights = self.weights / 7.0
+        np.testing.assert_allclose(
+            weighted.var(self.data[0], weights, ddof=1, weights_type="reliability"),
+            np.cov(self.data[0], aweights=weights),
+        )
+
+    def test_skew_kurtosis(self):
+        deviations = self.repeated - self.repeated.mean(axis=1, keepdims=True)
+        moment2 = np.mean(deviations**2, axis=1)
+        np.testing.assert_allclose(
+            weighted.skew(self.data, self.weights, axis=1),
+            np.mean(deviations**3, axis=1) / moment2**1.5,
+        )
+        np.testing.assert_allclose(
+            weighted.kurtosis(self.data, self.weights, axis=1),
+            np.mean(deviations**4, axis=1) / moment2**2 - 3,
+        )
+
+    def test_cov(self):
+        np.testing.assert_allclose(
+            weighted.cov(self.data, self.weights, ddof=1),
+            np.cov(self.data, fweights=self.weights),
+        )
+
+    def test_histogram(self):
+        hist, bin_edges = weighted.histogram(self.data, self.weights, bins=7, axis=1)
+        self.assertEqual(hist.shape, (3, 7))
+        for row, expected_row in zip(hist, self.data):
+            expected, _ = np.histogram(expected_row, bin_edges, weights=self.weights)
+            np.testing.assert_allclose(row, expected)
+
+    def test_histogram_density_all_axes(self):
+        data = self.data.ravel()
+        weights = np.tile(self.weights, 3)
+        actual, _ = weighted.histogram(data, weights, bins=5, density=True)
+        expected, _ = np.histogram(data, bins=5, weights=weights, density=True)
+        np.testing.assert_allclose(actual, expected)
+
+
+class TestKde(unittest.TestCase):
+    """Unit tests for the binned weighted kernel density estimate"""
+
+    def test_kde_matches_direct_sum(self):
+        rng = np.random.default_rng(11)
+        data = np.r_[rng.normal(size=3000), rng.normal(4, 0.5, size=1000)]
+        weights = rng.random(len(data))
+        grid, density = weighted.kde(data, weights, grid_size=512, bandwidth=0.3)
+        kernel = np.exp(-0.5 * ((grid[:, np.newaxis] - data) / 0.3) ** 2)
+        expected = kernel @ weights / (0.3 * np.sqrt(2 * np.pi) * weights.sum())
+        np.testing.assert_allclose(density, expected, atol=1e-4)
+        self.assertAlmostEqual(np.sum(density) * (grid[1] - grid[0]), 1.0, places=4)
+
+    def test_kde_default_bandwidth(self):
+        grid, density = weighted.kde([1.0, 2.0, np.nan, 3.0], [1, 2, 1, 1])
+        self.assertEqual(len(grid), 512)
+        self.assertEqual(grid[np.argmax(density)].round(1), 2.0)
+
+    def test_kde_invalid_bandwidth(self):
+        with self.assertRaises(ValueError):
+            weighted.kde([1.0, 1.0], [1, 1])
+
+
+class TestGroupbyQuantile(unittest.TestCase):
+    """Unit tests for grouped weighted quantiles"""
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        size = 2000
+        self.df = pd.DataFrame(
+            {
+                "group": rng.integers(0, 50, size),
+                "other": rng.choice(["a", "b"], size),
+                "value": rng.random(size),
+                "weight": rng.random(size),
+            }
+        )
+        self.df.loc[rng.random(size) < 0.1, "value"] = np.nan
+        self.df.loc[self.df["group"] == 3, "value"] = np.nan
+
+    def _expected(self, by, quantile_limit):
+        return self.df.groupby(by).apply(
+            lambda df: weighted.quantile_1d(df["value"], df["weight"], quantile_limit)
+        )
+
+    def test_groupby_quantile(self):
+        actual = weighted.groupby_quantile(self.df, "group", "value", "weight", 0.5)
+        expected = self._expected("group", 0.5)
+        pd.testing.assert_index_equal(actual.index, expected.index)
+        np.testing.assert_allclose(actual, expected.astype(float))
+        self.assertTrue(np.isnan(actual.loc[3]))
+
+    def test_groupby_quantile_many(self):
+        by = ["group", "other"]
+        actual = weighted.groupby_quantile(self.df, by, "value", "weight", [0.1, 0.9])
+        self.assertListEqual(list(actual.columns), [0.1, 0.9])
+        for quantile_limit in (0.1, 0.9):
+            expected = self._expected(by, quantile_limit)
+            np.testing.assert_allclose(actual[quantile_limit], expected.astype(float))
+
+    def test_groupby_quantile_null_key(self):
+        df = pd.DataFrame(
+            {"g": [1, 1, np.nan, 2], "v": [1.0, 2.0, 3.0, 4.0], "w": [1] * 4}
+        )
+        actual = weighted.groupby_quantile(df, "g", "v", "w", 0.5)
+        pd.testing.assert_series_equal(
+            actual,
+            pd.Series([1.5, 4.0], index=pd.Index([1.0, 2.0], name="g"), name="v"),
+        )
+
+
+class TestRolling(unittest.TestCase):
+    """Unit tests for rolling weighted statistics"""
+
+    def setUp(self):
+        rng = np.random.default_rng(9)
+        self.data = rng.random(200)
+        self.data[::17] = np.nan
+        self.weights = rng.random(200) + 0.01
+        self.weights[rng.random(200) < 0.3] = 0
+
+    def _expected(self, func, window):
+        result = []
+        for i in range(len(self.data)):
+            if window is not None and i < window - 1:
+                result.append(np.nan)
+                continue
+            start = 0 if window is None else i - window + 1
+            stop = i + 1
+            result.append(func(self.data[start:stop], self.weights[start:stop]))
+        return np.array(result)
+
+    @staticmethod
+    def _nanaverage(data, weights):
+        notnan = ~np.isnan(data)
+        if not np.any(weights[notnan]):
+            return np.nan
+        return np.average(data[notnan], weights=weights[notnan])
+
+    @staticmethod
+    def _quantile(data, weights, quantile_limit):
+        if not np.any(weights[~np.isnan(data)]):
+            return np.nan
+        return weighted.quantile_1d(data, weights, quantile_limit)
+
+    def test_rolling_quantile(self):
+        for window in (1, 5, 50):
+            for quantile_limit in (0.0, 0.3, 0.5, 1.0):
+                actual = weighted.rolling_quantile(
+                    self.data, self.weights, window, quantile_limit
+                )
+                expected = self._expected(
+                    lambda d, w, q=quantile_limit: self._quantile(d, w, q),
+                    window,
+                )
+                np.testing.assert_allclose(actual, expected)
+
+    def test_expanding_quantile(self):
+        actual = weighted.rolling_quantile(self.data, self.weights, None, 0.5)
+        expected = self._expected(lambda d, w: self._quantile(d, w, 0.5), None)
+        np.testing.assert_allclose(actual, expected)
+
+    def test_rolling_mean(self):
+        for window in (1, 5, 50, None):
+            actual = weighted.rolling_mean(self.data, self.weights, window)
+            expected = self._expected(self._nanaverage, window)
+            np.testing.assert_allclose(actual, expected)
+
+    def test_rolling_quantile_zero_weights(self):
+        self.data = np.array([0.52, 0.6, 0.69, 0.49, 0.82, 0.29])
+        self.weights = np.array([0.05, 0.82, 0.0, 0.51, 0.0, 0.0])
+        actual = weighted.rolling_quantile(self.data, self.weights, 2, 0.8)
+        expected = self._expected(lambda d, w: self._quantile(d, w, 0.8), 2)
+        np.testing.assert_allclose(actual, expected)
+        self.assertTrue(np.isnan(actual[-1]))
+        actual = weighted.rolling_quantile(
+            [0.1, 0.2, 0.3, 0.4], [0.1, 0.2, 0, 0], 2, 0.5
+        )
+        self.assertTrue(np.isnan(actual[-1]))
+
+    def test_rolling_window_too_large(self):
+        with self.assertRaises(ValueError):
+            weighted.rolling_mean([1, 2], [1, 1], 3)
+
+
+class TestWeightedECDF(unittest.TestCase):
+    """Unit tests for the weighted empirical distribution"""
+
+    def setUp(self):
+        rng = np.random.default_rng(8)
+        self.data = rng.normal(size=500)
+        self.data[::50] = np.nan
+        self.weights = rng.random(500)
+        self.ecdf = weighted.WeightedECDF(self.data, self.weights)
+
+    def test_quantile_matches_quantile_1d(self):
+        quantile_limits = np.linspace(0, 1, 11)
+        np.testing.assert_array_equal(
+            self.ecdf.quantile(quantile_limits),
+            weighted.quantile_1d(self.data, self.weights, quantile_limits),
+        )
+
+    def test_cdf(self):
+        notnan = ~np.isnan(self.data)
+        total = self.weights[notnan].sum()
+        x = np.array([-10, -0.5, 0.0, 1.5, 10])
+        expected = [self.weights[notnan & (self.data <= value)].sum() for value in x]
+        np.testing.assert_allclose(self.ecdf.cdf(x), np.array(expected) / total)
+        np.testing.assert_allclose(self.ecdf.cdf([np.nan, 10]), [np.nan, 1])
+        self.assertTrue(np.isnan(self.ecdf.cdf(np.nan)))
+
+    def test_interval(self):
+        low, high = self.ecdf.interval([0.5, 0.9])
+        np.testing.assert_array_equal(low, self.ecdf.quantile([0.25, 0.05]))
+        np.testing.assert_array_equal(high, self.ecdf.quantile([0.75, 0.95]))
+
+    def test_all_nan(self):
+        ecdf = weighted.WeightedECDF([np.nan, np.nan], [1, 1])
+        self.assertTrue(np.isnan(ecdf.quantile(0.5)))
+
+
+class TestWeightedQuantileSketch(unittest.TestCase):
+    """Unit tests for the streaming weighted quantile sketch"""
+
+    def setUp(self):
+        rng = np.random.default_rng(6)
+        self.data = rng.lognormal(size=100000)
+        self.weights = rng.random(100000)
+
+    def _rank(self, values):
+        ind_sorted = np.argsort(self.data)
+        sorted_weights = self.weights[ind_sorted]
+        cuml_weights = np.cumsum(sorted_weights)
+        prob = (cuml_weights - 0.5 * sorted_weights) / cuml_weights[-1]
+        return np.interp(values, self.data[ind_sorted], prob)
+
+    def test_small_sketch_is_exact(self):
+        sketch = weighted.WeightedQuantileSketch()
+        sketch.update([1, 1, 2, 3, 3], [0, 0, 1, 1, 1])
+        self.assertEqual(sketch.quantile(0.5), 3.0)
+        np.testing.assert_array_equal(
+            sketch.quantile([0, 0.25, 1]),
+            weighted.quantile_1d([1, 1, 2, 3, 3], [0, 0, 1, 1, 1], [0, 0.25, 1]),
+        )
+
+    def test_error_bound(self):
+        sketch = weighted.WeightedQuantileSketch(compression=100)
+        for chunk in np.array_split(np.arange(len(self.data)), 20):
+            sketch.update(self.data[chunk], self.weights[chunk])
+        quantile_limits = np.array([0.001, 0.1, 0.5, 0.9, 0.999])
+        error = np.abs(self._rank(sketch.quantile(quantile_limits)) - quantile_limits)
+        bound = np.pi * np.sqrt(quantile_limits * (1 - quantile_limits)) / 100
+        self.assertTrue(np.all(error <= bound), error)
+        self.assertEqual(sketch.min, self.data.min())
+        self.assertEqual(sketch.max, self.data.max())
+
+    def test_merge_and_serialize(self):
+        sketches = []
+        for chunk in np.array_split(np.arange(len(self.data)), 4):
+            sketch = weighted.WeightedQuantileSketch()
+            sketch.update(self.data[chunk], self.weights[chunk])
+            sketches.append(sketch.to_bytes())
+
+        merged = weighted.WeightedQuantileSketch.from_bytes(sketches[0])
+        for buffer in sketches[1:]:
+            merged.merge(weighted.WeightedQuantileSketch.from_bytes(buffer))
+        self.assertAlmostEqual(merged.total_weight, self.weights.sum())
+        self.assertAlmostEqual(self._rank(merged.quantile(0.5)), 0.5, places=2)
+
+        restored = weighted.WeightedQuantileSketch.from_bytes(merged.to_bytes())
+        np.testing.assert_array_equal(restored.means, merged.means)
+        np.testing.assert_array_equal(restored.weights, merged.weights)
+
+    def test_from_bytes_invalid(self):
+        with self.assertRaises(ValueError):
+            weighted.WeightedQuantileSketch.from_bytes(b"0" * 64)
+
 
 # %%
 
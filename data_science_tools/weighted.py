@@ -2,101 +2,890 @@
 Library to compute weighted quantiles, including the weighted median, of
 numpy arrays.
 """
+import struct
+
 import numpy as np
+import pandas as pd
+
+from ._quantile import (
+    quantile_1d,
+    quantile_select_1d,
+    quantile,
+    _as_rows,
+    _broadcast_weights,
+    _check_1d,
+    _check_quantile_limit,
+    _interp_segments,
+    _normalize_axes,
+)
 
 __version__ = "0.3"
 
-__all__ = ["quantile_1d", "quantile", "median", "mean"]
+__all__ = [
+    "quantile_1d",
+    "quantile_select_1d",
+    "quantile",
+    "median",
+    "mean",
+    "var",
+    "std",
+    "skew",
+    "kurtosis",
+    "cov",
+    "histogram",
+    "kde",
+    "groupby_quantile",
+    "rolling_quantile",
+    "rolling_mean",
+    "WeightedECDF",
+    "WeightedQuantileSketch",
+]
+
+
+def groupby_quantile(df, by, value, weight, quantile_limit):
+    """Weighted quantile of a column for every group of a dataframe.
+
+    Equivalent to `df.groupby(by).apply(lambda g: quantile_1d(g[value],
+    g[weight], quantile_limit))` but sorts once by (group, value) and
+    computes the cumulative weights of every group with one segmented cumsum
+    and all the interpolations together.
+
+    Parameters:
+        df : DataFrame
+            Input data.
+        by : str or list of str
+            Column(s) to group by, as in `df.groupby(by)`.
+        value : str
+            Column to compute the quantiles of.
+        weight : str
+            Column of the weights.
+        quantile_limit : float or array_like of floats
+            Quantile(s) to compute. They must have values between 0 and 1.
+
+    Returns:
+        Series or DataFrame: Indexed by group. A Series for a single quantile
+            or a DataFrame with a column per quantile.
+    """
+    _check_quantile_limit(quantile_limit)
+    grouped = df.groupby(by, sort=True)
+    index = grouped.size().index
+    # null group keys are dropped by groupby, ngroup gives them NaN (or -1 in
+    # older pandas)
+    codes = grouped.ngroup().to_numpy(dtype=float)
+    data = df[value].to_numpy(dtype=float)
+    keep = ~np.isnan(codes) & (codes >= 0) & ~np.isnan(data)
+    sorted_data, prob_normalized, starts, stops = _sorted_groups(
+        codes[keep].astype(np.intp),
+        data[keep],
+        np.nan_to_num(df[weight].to_numpy(dtype=float)[keep]),
+        len(index),
+    )
+
+    result = _interp_segments(
+        np.expand_dims(quantile_limit, -1),
+        prob_normalized,
+        sorted_data,
+        starts,
+        stops,
+    )
+    if np.ndim(quantile_limit) == 0:
+        return pd.Series(result, index=index, name=value)
+    return pd.DataFrame(
+        result.reshape((-1, len(index))).T,
+        index=index,
+        columns=np.ravel(quantile_limit),
+    )
+
+
+def _sorted_groups(codes, data, weights, groups):
+    """Sort by (group, value) and normalize the cumulative weights per group
+
+    Returns:
+        (sorted_data, prob_normalized, starts, stops): starts and stops are
+            the segment of every group in the sorted arrays.
+    """
+    ind_sorted = np.lexsort((data, codes))
+    sorted_codes = codes[ind_sorted]
+    sorted_weights = weights[ind_sorted]
+
+    group_codes = np.arange(groups)
+    starts = np.searchsorted(sorted_codes, group_codes, side="left")
+    stops = np.searchsorted(sorted_codes, group_codes, side="right")
+
+    # segmented cumsum, subtract the running total before each group
+    cuml_weights = np.cumsum(sorted_weights)
+    weight_before = np.r_[0.0, cuml_weights][starts]
+    weight_total = np.r_[0.0, cuml_weights][stops] - weight_before
+    cuml_weights -= weight_before[sorted_codes]
+    group_weights = weight_total[sorted_codes]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        prob_normalized = (cuml_weights - 0.5 * sorted_weights) / group_weights
+    return data[ind_sorted], prob_normalized, starts, stops
+
+
+def median(data, weights, axis=-1):
+    """Weighted median of an array with respect to the given axis.
+
+    Alias for `quantile(data, weights, 0.5, axis=axis)`. For large one
+    dimensional data `quantile_select_1d(data, weights, 0.5)` avoids the full
+    sort, but may settle on a different one of tied values.
+    """
+    return quantile(data, weights, 0.5, axis=axis)
+
 
+def mean(data, weights, **kws):
+    """Weighted mean
+
+    Alias for `np.average(data, weights=weights, **kws)`
+    """
+    return np.average(data, weights=weights, **kws)
 
-def quantile_1d(data, weights, quantile_limit):
-    """Compute the weighted quantile of a 1D numpy array.
+
+def var(data, weights, axis=None, ddof=0, weights_type="frequency"):
+    """Weighted variance
+
+    Two passes over the data, one for the mean and one for the squared
+    deviations.
 
     Parameters:
         data : ndarray
-            Input array (one dimension).
+            Input array.
         weights : ndarray
-            Array with the weights of the same size of `data`.
-        quantile_limit : float
-            Quantile to compute. It must have a value between 0 and 1.
+            Array with the weights, shaped like the reduced axes of `data` or
+            broadcastable to `data`.
+        axis : int, tuple of ints or None
+            Axis or axes to reduce. None is all the axes, like `mean`.
+        ddof : int
+            Delta degrees of freedom of the normalization.
+        weights_type : str
+            'frequency' if the weights are counts of repeated observations,
+            normalized by `sum(w) - ddof`. 'reliability' if they are relative
+            importances, normalized by `sum(w) - ddof * sum(w**2) / sum(w)`.
 
     Returns:
-        quantile_1d : float
+        var : float or ndarray
             The output value.
     """
-    data = np.asarray(data)
-    weights = np.asarray(weights)
-    if data.ndim != 1:
-        raise TypeError("data must be a one dimensional array")
+    if weights_type not in ("frequency", "reliability"):
+        raise ValueError("weights_type should be 'frequency' or 'reliability'")
+    data, weights, axes = _check_moments(data, weights, axis)
+    weight_sum, _, (moment2,) = _central_moments(data, weights, axes, (2,))
+    if weights_type == "frequency":
+        norm = weight_sum - ddof
+    else:
+        weight_sq_sum = np.sum(
+            np.broadcast_to(weights**2, data.shape), axis=axes, keepdims=True
+        )
+        norm = weight_sum - ddof * weight_sq_sum / weight_sum
+    return _squeeze(moment2 * weight_sum / norm, axes)
 
-    if data.shape != weights.shape:
-        raise TypeError("the length of data and weights must be the same")
 
-    if not 0.0 <= quantile_limit <= 1.0:
-        raise ValueError("quantile must have a value between 0.0 and 1.0")
+def std(data, weights, axis=None, ddof=0, weights_type="frequency"):
+    """Weighted standard deviation
 
-    # Sort the data
-    ind_sorted = np.argsort(data)
-    sorted_data = data[ind_sorted]
-    notnan = ~np.isnan(sorted_data)
-    if np.count_nonzero(notnan) == 0:
-        return np.nan
+    Square root of `var(data, weights, axis, ddof, weights_type)`.
+    """
+    return np.sqrt(var(data, weights, axis, ddof, weights_type))
 
-    sorted_weights = np.nan_to_num(weights[ind_sorted][notnan])
 
-    # Compute the auxiliary arrays
-    cuml_weights = np.cumsum(sorted_weights)
+def skew(data, weights, axis=None):
+    """Weighted (population) skewness, m3 / m2**1.5
 
-    # TO DO: Check that the weights do not sum zero
-    prob_normalized = (cuml_weights - 0.5 * sorted_weights) / np.sum(sorted_weights)
+    Parameters:
+        data : ndarray
+            Input array.
+        weights : ndarray
+            Array with the weights, shaped like the reduced axes of `data` or
+            broadcastable to `data`.
+        axis : int, tuple of ints or None
+            Axis or axes to reduce. None is all the axes, like `mean`.
 
-    # Get the value of the weighted median
-    return np.interp(quantile_limit, prob_normalized, sorted_data[notnan])
+    Returns:
+        skew : float or ndarray
+            The output value.
+    """
+    data, weights, axes = _check_moments(data, weights, axis)
+    _, _, (moment2, moment3) = _central_moments(data, weights, axes, (2, 3))
+    return _squeeze(moment3 / moment2**1.5, axes)
 
 
-def quantile(data, weights, quantile_limit):
-    """Weighted quantile of an array with respect to the last axis.
+def kurtosis(data, weights, axis=None, fisher=True):
+    """Weighted (population) kurtosis, m4 / m2**2
 
     Parameters:
         data : ndarray
             Input array.
         weights : ndarray
-            Array with the weights. It must have the same size of the last
-            axis of `data`.
-        quantile_limit : float
-            Quantile to compute. It must have a value between 0 and 1.
+            Array with the weights, shaped like the reduced axes of `data` or
+            broadcastable to `data`.
+        axis : int, tuple of ints or None
+            Axis or axes to reduce. None is all the axes, like `mean`.
+        fisher : bool
+            If True subtract 3 so a normal distribution is 0.
 
     Returns:
-        quantile : float
+        kurtosis : float or ndarray
             The output value.
+    """
+    data, weights, axes = _check_moments(data, weights, axis)
+    _, _, (moment2, moment4) = _central_moments(data, weights, axes, (2, 4))
+    return _squeeze(moment4 / moment2**2 - 3.0 * fisher, axes)
+
+
+def cov(data, weights, ddof=0, weights_type="frequency"):
+    """Weighted covariance matrix
+
+    Like `np.cov`, each row of `data` is a variable and each column an
+    observation.
+
+    Parameters:
+        data : ndarray
+            Input array (one or two dimensions) of (variables, observations).
+        weights : ndarray
+            Weights of the observations, the size of the last axis of `data`.
+        ddof : int
+            Delta degrees of freedom of the normalization.
+        weights_type : str
+            'frequency' or 'reliability', see `var`.
+
+    Returns:
+        cov : ndarray
+            Covariance matrix of (variables, variables).
+    """
+    if weights_type not in ("frequency", "reliability"):
+        raise ValueError("weights_type should be 'frequency' or 'reliability'")
+    data = np.atleast_2d(np.asarray(data, dtype=np.result_type(data, float)))
+    weights = np.asarray(weights, dtype=data.dtype)
+    if data.ndim != 2 or weights.shape != data.shape[-1:]:
+        raise TypeError("weights must be the size of the last axis of data")
+
+    weight_sum = np.sum(weights)
+    deviations = data - (data @ weights / weight_sum)[:, np.newaxis]
+    if weights_type == "frequency":
+        norm = weight_sum - ddof
+    else:
+        norm = weight_sum - ddof * np.sum(weights**2) / weight_sum
+    return (deviations * weights) @ deviations.T / norm
+
+
+def histogram(data, weights, bins=10, range=None, axis=None, density=False):
+    """Weighted histogram along an axis with shared bin edges
+
+    Every row along the other axes is binned together with one
+    `np.searchsorted` and one `np.bincount`. NaN values are ignored.
+
+    Parameters:
+        data : ndarray
+            Input array.
+        weights : ndarray
+            Array with the weights, shaped like the reduced axes of `data` or
+            broadcastable to `data`.
+        bins : int or sequence of floats
+            Number of equal width bins or the bin edges, see `np.histogram`.
+        range : (float, float)
+            Lower and upper range of the bins. Default is the data range.
+        axis : int, tuple of ints or None
+            Axis or axes to histogram. None is all the axes, like
+            `np.histogram`.
+        density : bool
+            If True normalize each histogram to integrate to one.
 
+    Returns:
+        (hist, bin_edges): hist has the shape of `data` without the reduced
+            axes plus a last axis of the bins.
     """
+    # pylint: disable=redefined-builtin
     data = np.asarray(data)
-    # TO DO: Allow to specify the axis
-    if data.ndim == 0:
-        raise TypeError("data must have at least one dimension")
+    axes = _normalize_axes(axis, data.ndim)
+    weights = _broadcast_weights(data, weights, axes)
+    finite = data[np.isfinite(data)]
+    bin_edges = np.histogram_bin_edges(finite, bins=bins, range=range)
+    nbins = len(bin_edges) - 1
+
+    data, weights, shape = _as_rows(data, weights, axes)
+    weights = np.broadcast_to(weights, data.shape)
+    ind = np.searchsorted(bin_edges, data, side="right") - 1
+    # the last edge is included in the last bin, like np.histogram
+    ind[data == bin_edges[-1]] = nbins - 1
+    valid = (ind >= 0) & (ind < nbins) & ~np.isnan(data)
+    ind += np.arange(len(data))[:, np.newaxis] * nbins
 
-    elif data.ndim == 1:
-        return quantile_1d(data, weights, quantile_limit)
+    hist = np.bincount(ind[valid], weights=weights[valid], minlength=len(data) * nbins)
+    hist = hist.reshape(shape + (nbins,))
+    if density:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            hist = hist / hist.sum(axis=-1, keepdims=True) / np.diff(bin_edges)
+    return hist, bin_edges
 
-    # elif data.ndim > 1:
-    shape = data.shape
-    imr = data.reshape((np.prod(shape[:-1]), shape[-1]))
-    result = np.apply_along_axis(quantile_1d, -1, imr, weights, quantile_limit)
-    return result.reshape(shape[:-1])
 
+def kde(data, weights, grid_size=512, bandwidth=None, cut=3.0):
+    """Weighted Gaussian kernel density estimate on a regular grid
 
-def median(data, weights):
-    """Weighted median of an array with respect to the last axis.
+    The weighted samples are linearly binned onto the grid and convolved
+    with the kernel by FFT, O(n + g log g) instead of the O(n g) direct sum.
+    The error from the binning is small when the bandwidth spans a few grid
+    cells. NaN values are ignored.
 
-    Alias for `quantile(data, weights, 0.5)`.
+    Parameters:
+        data : ndarray
+            Input samples, flattened.
+        weights : ndarray
+            Array with the weights of the same size of `data`.
+        grid_size : int
+            Number of grid points.
+        bandwidth : float
+            Standard deviation of the Gaussian kernel. Default is Silverman's
+            rule of thumb, 1.06 * std * n_eff ** -0.2, with the weighted std
+            and the effective sample size sum(w)**2 / sum(w**2).
+        cut : float
+            The grid extends `cut * bandwidth` beyond the data range.
+
+    Returns:
+        (grid, density): The grid points and the density at each of them,
+            normalized to integrate to one.
     """
-    return quantile(data, weights, 0.5)
+    data = np.asarray(data, dtype=float).ravel()
+    weights = np.broadcast_to(np.asarray(weights, dtype=float), np.shape(data))
+    notnan = ~np.isnan(data)
+    data = data[notnan]
+    weights = np.nan_to_num(weights[notnan])
+    if grid_size < 2:
+        raise ValueError("grid_size must be at least 2")
+    if not len(data):
+        raise ValueError("data must have at least one value")
 
+    total_weight = np.sum(weights)
+    if bandwidth is None:
+        effective_size = total_weight**2 / np.sum(weights**2)
+        bandwidth = 1.06 * std(data, weights) * effective_size**-0.2
+    if not bandwidth > 0:
+        raise ValueError("bandwidth must be positive")
 
-def mean(data, weights, **kws):
-    """Weighted mean
+    grid = np.linspace(
+        data.min() - cut * bandwidth, data.max() + cut * bandwidth, grid_size
+    )
+    convolved = _gaussian_convolve(
+        _linear_binning(data, weights, grid), grid, bandwidth
+    )
+    # FFT round off can be slightly negative far from the data
+    return grid, np.maximum(convolved / total_weight, 0.0)
 
-    Alias for `np.average(data, weights=weights, **kws)`
+
+def _linear_binning(data, weights, grid):
+    """Split each weight between the two nearest points of a regular grid"""
+    step = grid[1] - grid[0]
+    position = (data - grid[0]) / step
+    left = np.clip(np.floor(position).astype(int), 0, len(grid) - 2)
+    fraction = position - left
+    binned = np.bincount(left, weights * (1 - fraction), minlength=len(grid))
+    binned += np.bincount(left + 1, weights * fraction, minlength=len(grid))
+    return binned
+
+
+def _gaussian_convolve(binned, grid, bandwidth):
+    """Convolve values on a regular grid with a Gaussian kernel by FFT"""
+    grid_size = len(grid)
+    step = grid[1] - grid[0]
+    # kernel out to 5 bandwidths, zero padded so the convolution is linear
+    half_width = int(min(grid_size - 1, np.ceil(5 * bandwidth / step)))
+    offsets = np.arange(-half_width, half_width + 1) * step
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (
+        bandwidth * np.sqrt(2 * np.pi)
+    )
+    size = 1 << int(np.ceil(np.log2(grid_size + 2 * half_width)))
+    convolved = np.fft.irfft(
+        np.fft.rfft(binned, size) * np.fft.rfft(kernel, size), size
+    )
+    return convolved[half_width:][:grid_size]
+
+
+def _check_moments(data, weights, axis):
+    """Validate inputs of the moments, returns data, weights and axes"""
+    data = np.asarray(data)
+    data = data.astype(np.result_type(data, float), copy=False)
+    axes = _normalize_axes(axis, data.ndim)
+    weights = _broadcast_weights(data, weights, axes)
+    return data, weights, axes
+
+
+def _central_moments(data, weights, axes, orders):
+    """Weighted central moments normalized by the sum of the weights.
+
+    The first pass computes the mean, the second the deviations and their
+    powers. Results keep the reduced dimensions.
+
+    Returns:
+        (weight_sum, weighted_mean, moments): moments in the same order as `orders`.
     """
-    return np.average(data, weights=weights, **kws)
+    weight_sum = np.sum(np.broadcast_to(weights, data.shape), axis=axes, keepdims=True)
+    weighted_mean = np.sum(data * weights, axis=axes, keepdims=True) / weight_sum
+    deviations = data - weighted_mean
+    power = deviations * weights
+    moments = {}
+    for order in range(2, max(orders) + 1):
+        power *= deviations
+        if order in orders:
+            moments[order] = np.sum(power, axis=axes, keepdims=True) / weight_sum
+    return weight_sum, weighted_mean, tuple(moments[order] for order in orders)
+
+
+def _squeeze(result, axes):
+    """Drop the reduced dimensions kept by _central_moments"""
+    return np.squeeze(result, axis=axes)[()]
+
+
+def rolling_mean(data, weights, window=None):
+    """Weighted mean over a trailing window.
+
+    Computed from cumulative sums of `weights * data` and `weights`, so the
+    cost is O(n) whatever the window. NaN values are ignored (zero weight).
+
+    Parameters:
+        data : ndarray
+            Input array (one dimension).
+        weights : ndarray
+            Array with the weights of the same size of `data`.
+        window : int or None
+            Number of observations in the window ending at (and including)
+            each position. None is an expanding window from the start.
+
+    Returns:
+        rolling_mean : ndarray
+            Same length as `data`, NaN until the first full window.
+    """
+    data, weights = _check_rolling(data, weights, window)
+    notnan = ~np.isnan(data)
+    weights = np.where(notnan, np.nan_to_num(weights), 0.0)
+    cuml_weights = np.r_[0.0, np.cumsum(weights)]
+    cuml_values = np.r_[0.0, np.cumsum(weights * np.where(notnan, data, 0.0))]
+    # differences of float cumsums leave rounding residue where a window has
+    # no weight, the count of positive weights is exact
+    cuml_positive = np.r_[0, np.cumsum(weights > 0)]
+
+    result = np.full(len(data), np.nan)
+    first = 0 if window is None else window - 1
+    if window is None:
+        weight_sums = cuml_weights[1:]
+        value_sums = cuml_values[1:]
+        positive = cuml_positive[1:]
+    else:
+        weight_sums = cuml_weights[window:] - cuml_weights[:-window]
+        value_sums = cuml_values[window:] - cuml_values[:-window]
+        positive = cuml_positive[window:] - cuml_positive[:-window]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result[first:] = np.where(positive > 0, value_sums / weight_sums, np.nan)
+    return result
+
+
+def rolling_quantile(data, weights, window, quantile_limit):
+    """Weighted quantile over a trailing window.
+
+    Same interpolation as `quantile_1d` on every window, but the window is
+    kept in order incrementally. Each value is ranked once up front and two
+    binary indexed (Fenwick) trees over the ranks hold the weights and
+    counts in the window. Adding, removing and finding the quantile are all
+    O(log n) per step instead of sorting each window. NaN values are
+    ignored.
+
+    Parameters:
+        data : ndarray
+            Input array (one dimension).
+        weights : ndarray
+            Non-negative weights of the same size of `data`.
+        window : int or None
+            Number of observations in the window ending at (and including)
+            each position. None is an expanding window from the start.
+        quantile_limit : float
+            Quantile to compute. It must have a value between 0 and 1.
+
+    Returns:
+        rolling_quantile : ndarray
+            Same length as `data`, NaN until the first full window.
+    """
+    data, weights = _check_rolling(data, weights, window)
+    _check_quantile_limit(quantile_limit)
+    size = len(data)
+    weights = np.nan_to_num(weights)
+
+    # rank of every value, NaN values are never added to the trees
+    ind_sorted = np.argsort(data, kind="mergesort")
+    ranks = np.empty(size, dtype=int)
+    ranks[ind_sorted] = np.arange(size)
+    sorted_data = data[ind_sorted].tolist()
+    weights = _exact_integers(weights.tolist())
+    sorted_weights = [weights[i] for i in ind_sorted.tolist()]
+    notnan = (~np.isnan(data)).tolist()
+    ranks = ranks.tolist()
+
+    weight_tree = _FenwickTree(size)
+    count_tree = _FenwickTree(size)
+    start = 0 if window is None else 1 - window
+    result = np.full(size, np.nan)
+    for i in range(size):
+        if notnan[i]:
+            weight_tree.add(ranks[i], weights[i])
+            count_tree.add(ranks[i], 1)
+        if start > 0 and notnan[start - 1]:
+            weight_tree.add(ranks[start - 1], -weights[start - 1])
+            count_tree.add(ranks[start - 1], -1)
+        if start >= 0:
+            result[i] = _fenwick_quantile(
+                weight_tree, count_tree, sorted_data, sorted_weights, quantile_limit
+            )
+        start += window is not None
+
+    return result
+
+
+def _exact_integers(values):
+    """Non-negative floats as integers over a common power of two
+
+    Sums of the integers are exact, so adding and removing them leaves no
+    rounding residue, and ratios of them are ratios of the floats.
+    """
+    ratios = [value.as_integer_ratio() for value in values]
+    denominator = max((d for _, d in ratios), default=1)
+    return [n * (denominator // d) for n, d in ratios]
+
+
+def _check_rolling(data, weights, window):
+    """Validate the rolling inputs, returns them as float arrays"""
+    data, weights = _check_1d(data, weights, dtype=float)
+    if window is not None and not 1 <= window <= len(data):
+        raise ValueError("window must be between 1 and the length of data")
+    return data, weights
+
+
+def _fenwick_quantile(weight_tree, count_tree, sorted_data, sorted_weights, q):
+    """Interpolate the weighted quantile of the ranks in the trees.
+
+    Finds the first element whose normalized probability exceeds `q` and the
+    element before it, like `np.interp` in `quantile_1d`. The weights are
+    integers so the probabilities are exact ratios.
+    """
+    count = count_tree.prefix(count_tree.size)
+    total_weight = weight_tree.prefix(weight_tree.size)
+    if count == 0 or total_weight <= 0:
+        return np.nan
+
+    trees = (weight_tree, count_tree, sorted_weights, total_weight)
+    previous, position, weight_below = _fenwick_bracket(trees, count, q)
+    if previous is None:
+        return sorted_data[position]
+    prob = (2 * weight_below + sorted_weights[position]) / (2 * total_weight)
+    prob_previous = (2 * weight_below - sorted_weights[previous]) / (2 * total_weight)
+    if prob_previous in (q, prob):
+        return sorted_data[previous]
+    slope = (sorted_data[position] - sorted_data[previous]) / (prob - prob_previous)
+    return slope * (q - prob_previous) + sorted_data[previous]
+
+
+def _fenwick_bracket(trees, count, q):
+    """Positions of the elements whose probabilities bracket `q`.
+
+    `trees` is (weight_tree, count_tree, sorted_weights, total_weight).
+    Returns (previous, position, weight below position), previous is None
+    when the quantile is the value at position itself.
+    """
+    weight_tree, count_tree, sorted_weights, total_weight = trees
+    # first element whose cumulative weight exceeds the target. It is either
+    # the crossing element or the one just before it.
+    position = weight_tree.search(q * total_weight)
+    rank = count_tree.prefix(position)
+    if rank == count:
+        return None, count_tree.search(count - 1), None
+    position = count_tree.search(rank)
+    weight_below = weight_tree.prefix(position)
+    if (2 * weight_below + sorted_weights[position]) / (2 * total_weight) > q:
+        if rank == 0:
+            return None, position, weight_below
+        return count_tree.search(rank - 1), position, weight_below
+    if rank + 1 == count:
+        return None, position, weight_below
+
+    following = count_tree.search(rank + 1)
+    weight_below += sorted_weights[position]
+    if sorted_weights[following] == 0 and weight_below / total_weight == q:
+        # the zero weights up to the next positive weight share this
+        # probability, np.interp takes the last of them
+        end = weight_tree.search(weight_below)
+        return None, count_tree.search(count_tree.prefix(end) - 1), weight_below
+    return position, following, weight_below
+
+
+class _FenwickTree:
+    """Binary indexed tree for prefix sums of non-negative values"""
+
+    def __init__(self, size):
+        self.size = size
+        self.tree = [0] * (size + 1)
+        self.step = 1 << (size.bit_length() - 1) if size else 0
+
+    def add(self, position, value):
+        """Add value at position"""
+        i = position + 1
+        tree = self.tree
+        while i <= self.size:
+            tree[i] += value
+            i += i & -i
+
+    def prefix(self, position):
+        """Sum of the values before position"""
+        total = 0
+        tree = self.tree
+        while position > 0:
+            total += tree[position]
+            position -= position & -position
+        return total
+
+    def search(self, target):
+        """First position where the inclusive prefix sum exceeds target"""
+        position = 0
+        step = self.step
+        tree = self.tree
+        while step:
+            i = position + step
+            if i <= self.size and tree[i] <= target:
+                position = i
+                target -= tree[i]
+            step >>= 1
+        return position
+
+
+class WeightedECDF:
+    """Weighted empirical distribution for repeated quantile and CDF queries.
+
+    The sort and the normalized cumulative weights of `quantile_1d` are
+    computed once, every query afterwards is a vectorized
+    `np.interp` / `np.searchsorted` lookup.
+
+    Parameters:
+        data : ndarray
+            Input array (one dimension). NaN values are ignored.
+        weights : ndarray
+            Array with the weights of the same size of `data`.
+    """
+
+    def __init__(self, data, weights):
+        data, weights = _check_1d(data, weights)
+
+        ind_sorted = np.argsort(data)
+        sorted_data = data[ind_sorted]
+        notnan = ~np.isnan(sorted_data)
+        self.sorted_data = sorted_data[notnan]
+        self.sorted_weights = np.nan_to_num(weights[ind_sorted][notnan])
+        self.cuml_weights = np.cumsum(self.sorted_weights)
+        self.total_weight = np.sum(self.sorted_weights)
+        self.prob_normalized = (
+            self.cuml_weights - 0.5 * self.sorted_weights
+        ) / self.total_weight
+
+    def quantile(self, quantile_limit):
+        """Weighted quantile(s), the same as `quantile_1d`.
+
+        Parameters:
+            quantile_limit : float or array_like of floats
+                Quantile(s) to compute. They must have values between 0 and 1.
+
+        Returns:
+            quantile : float or ndarray
+                Same shape as `quantile_limit`.
+        """
+        _check_quantile_limit(quantile_limit)
+        if not len(self.sorted_data):
+            return np.full(np.shape(quantile_limit), np.nan)[()]
+        return np.interp(quantile_limit, self.prob_normalized, self.sorted_data)
+
+    def cdf(self, x):
+        """Fraction of the total weight with data less than or equal to x.
+
+        Parameters:
+            x : float or array_like of floats
+                Values to evaluate the weighted CDF at.
+
+        Returns:
+            cdf : float or ndarray
+                Same shape as `x`, NaN where `x` is NaN.
+        """
+        ind = np.searchsorted(self.sorted_data, x, side="right")
+        cuml_weights = np.r_[0.0, self.cuml_weights]
+        # searchsorted puts NaN after all the data
+        return np.where(np.isnan(x), np.nan, cuml_weights[ind] / self.total_weight)[()]
+
+    def interval(self, confidence):
+        """Central interval containing `confidence` of the weight.
+
+        Parameters:
+            confidence : float or array_like of floats
+                Probability mass of the interval, between 0 and 1.
+
+        Returns:
+            (low, high) : tuple of floats or ndarrays
+                The quantiles at (1 - confidence) / 2 and (1 + confidence) / 2.
+        """
+        confidence = np.asarray(confidence)
+        return (
+            self.quantile((1 - confidence) / 2),
+            self.quantile((1 + confidence) / 2),
+        )
+
+
+class WeightedQuantileSketch:
+    """Mergeable streaming sketch of weighted quantiles.
+
+    A merging t-digest. Values are summarized by weighted centroids whose
+    size is limited along the arcsine scale function, so the tails are kept
+    at a higher resolution than the middle. Chunks are added with `update`,
+    sketches built in other processes are combined with `merge` and they
+    round trip through `to_bytes` / `from_bytes`.
+
+    Memory is bounded by about `compression` centroids plus the update
+    buffer. A centroid near quantile q covers at most about
+    `2 * pi * sqrt(q * (1 - q)) / compression` of the total weight, so the
+    rank error of `quantile` is within half of that (about 0.8% at the
+    median for the default compression of 200) and shrinks towards the
+    tails. The minimum and maximum are exact. Until `compression` values
+    have been seen the results are the same as `quantile_1d`.
+
+    Parameters:
+        compression : int
+            Accuracy parameter, larger is more accurate and uses more memory.
+        buffer_size : int
+            Number of values to buffer between compressions. Defaults to
+            `5 * compression`.
+    """
+
+    _header = struct.Struct("<4sdddQ")
+    _magic = b"WQS1"
+
+    def __init__(self, compression=200, buffer_size=None):
+        self.compression = compression
+        self.buffer_size = buffer_size or 5 * compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+        self._buffer = []
+
+    def update(self, values, weights=None):
+        """Add values with their weights, NaN values are ignored.
+
+        Parameters:
+            values : ndarray
+                Values to add.
+            weights : ndarray
+                Weights of the same shape as `values`. Default is all ones.
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        if weights is None:
+            weights = np.ones(len(values))
+        else:
+            weights = np.broadcast_to(np.asarray(weights, dtype=float), values.shape)
+        notnan = ~np.isnan(values)
+        values = values[notnan]
+        weights = np.nan_to_num(weights[notnan])
+        if not len(values):
+            return self
+
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._buffer.append((values, weights))
+        if sum(len(means) for means, _ in self._buffer) > self.buffer_size:
+            self._flush()
+        return self
+
+    def merge(self, other):
+        """Merge another sketch into this one and return this one"""
+        other._flush()  # pylint: disable=protected-access
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._buffer.append((other.means, other.weights))
+        self._flush()
+        return self
+
+    @property
+    def total_weight(self):
+        """Total weight of everything added"""
+        self._flush()
+        return np.sum(self.weights)
+
+    def quantile(self, quantile_limit):
+        """Approximate weighted quantile(s).
+
+        Parameters:
+            quantile_limit : float or array_like of floats
+                Quantile(s) to compute. They must have values between 0 and 1.
+
+        Returns:
+            quantile : float or ndarray
+                Same interpolation as `quantile_1d` over the centroids,
+                clamped to the exact minimum and maximum.
+        """
+        _check_quantile_limit(quantile_limit)
+        self._flush()
+        if not len(self.means):
+            if np.ndim(quantile_limit):
+                return np.full(np.shape(quantile_limit), np.nan)
+            return np.nan
+        cuml_weights = np.cumsum(self.weights)
+        prob_normalized = (cuml_weights - 0.5 * self.weights) / cuml_weights[-1]
+        return np.interp(
+            quantile_limit,
+            np.r_[0.0, prob_normalized, 1.0],
+            np.r_[self.min, self.means, self.max],
+        )
+
+    def to_bytes(self):
+        """Serialize the sketch"""
+        self._flush()
+        header = self._header.pack(
+            self._magic, self.compression, self.min, self.max, len(self.means)
+        )
+        centroids = np.stack([self.means, self.weights]).astype("<f8")
+        return header + centroids.tobytes()
+
+    @classmethod
+    def from_bytes(cls, buffer):
+        """Load a sketch serialized with `to_bytes`"""
+        magic, compression, minimum, maximum, size = cls._header.unpack_from(buffer)
+        if magic != cls._magic:
+            raise ValueError("buffer is not a serialized WeightedQuantileSketch")
+        centroids = np.frombuffer(
+            buffer, dtype="<f8", count=2 * size, offset=cls._header.size
+        ).reshape((2, size))
+        sketch = cls(compression=int(compression))
+        sketch.means = centroids[0].astype(float)
+        sketch.weights = centroids[1].astype(float)
+        sketch.min = minimum
+        sketch.max = maximum
+        return sketch
+
+    def _flush(self):
+        """Merge the buffer into the centroids"""
+        if not self._buffer:
+            return
+        means = np.concatenate([self.means] + [means for means, _ in self._buffer])
+        weights = np.concatenate(
+            [self.weights] + [weights for _, weights in self._buffer]
+        )
+        self._buffer = []
+
+        ind_sorted = np.argsort(means, kind="mergesort")
+        self.means = means[ind_sorted]
+        self.weights = weights[ind_sorted]
+        if len(self.means) > self.compression:
+            self._compress()
+
+    def _compress(self):
+        """Combine adjacent centroids within one unit of the scale function"""
+        cuml_weights = np.cumsum(self.weights)
+        prob_normalized = (cuml_weights - 0.5 * self.weights) / cuml_weights[-1]
+        scale = self.compression / (2 * np.pi) * np.arcsin(2 * prob_normalized - 1)
+        bins = np.floor(scale)
+        starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+        weights = np.add.reduceat(self.weights, starts)
+        with np.errstate(invalid="ignore"):
+            means = np.add.reduceat(self.means * self.weights, starts) / weights
+        # groups with no weight keep their (unweighted) first value
+        self.means = np.where(weights > 0, means, self.means[starts])
+        self.weights = weights
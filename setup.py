@@ -29,12 +29,14 @@ setup(
     license="MIT",
     description="Various tools useful for data science work",
     long_description=load_description(),
-    python_requires=">=3.6",
+    python_requires=">=3.9",
     packages=find_packages(),
     include_package_data=True,
     install_requires=[
         # For data manipulation.
         "pandas >= 0.23.4",
+        # For Generator.permuted and np.broadcast_shapes.
+        "numpy >= 1.20",
     ],
     extras_require={
         "matplotlib": [